@@ -0,0 +1,197 @@
+"""Локальная имитация Tilda API и CDN для бенчмарков экспортера"""
+import json
+import multiprocessing
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+from urllib.parse import parse_qs, urlsplit
+from urllib.request import urlopen
+
+from pydantic import BaseModel
+
+
+class MockSettings(BaseModel):
+    """Параметры имитируемого проекта и сети"""
+    pages: int = 20
+    assets_per_page: int = 10
+    shared_assets: int = 6
+    project_assets: int = 3
+    asset_size: int = 100 * 1024
+    html_size: int = 50 * 1024
+    # Задержка ответа API и CDN, в секундах
+    api_latency: float = 0.05
+    cdn_latency: float = 0.02
+    # Доля запросов, на которые сервер отвечает 500
+    error_rate: float = 0.0
+    seed: int = 0
+
+
+class MockTildaHandler(BaseHTTPRequestHandler):
+    """Обработчик запросов: /v1/<метод>/ - API, /cdn/<файл> - ассеты, /__stats - счетчики"""
+    protocol_version = 'HTTP/1.1'
+    server: 'MockTildaServer'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        if url.path == '/__stats':
+            self._send(200, json.dumps(self.server.stats).encode(), 'application/json')
+            return
+
+        settings = self.server.settings
+        is_api = url.path.startswith('/v1/')
+        self.server.count('api_' + url.path.split('/')[2] if is_api else 'cdn')
+        time.sleep(settings.api_latency if is_api else settings.cdn_latency)
+
+        if self.server.should_fail():
+            self.server.count('errors')
+            self._send(500, b'injected error', 'text/plain')
+        elif is_api:
+            self._handle_api(url.path.split('/')[2], {k: v[0] for k, v in parse_qs(url.query).items()})
+        else:
+            self._handle_cdn(url.path)
+
+    def _handle_api(self, method: str, params: dict):
+        """Ответы в формате Tilda API"""
+        settings = self.server.settings
+        if method == 'getprojectinfo':
+            result = {
+                'id': params.get('projectid'),
+                'images': [self._asset(f'project{i}.png') for i in range(settings.project_assets)]
+            }
+        elif method == 'getpageslist':
+            result = [self._page(i) for i in range(settings.pages)]
+        elif method == 'getpagefullexport':
+            index = int(params.get('pageid', 0)) - 1000
+            if not 0 <= index < settings.pages:
+                self._send(200, json.dumps({'status': 'ERROR', 'message': 'Page not found'}).encode(),
+                           'application/json')
+                return
+            result = self._page(index)
+            result['html'] = self.server.html
+            result['images'] = [self._asset(f'img{index}_{j}.jpg') for j in range(settings.assets_per_page)]
+            result['css'] = [self._asset(f'tilda-shared-{j}.min.css') for j in range(0, settings.shared_assets, 2)]
+            result['js'] = [self._asset(f'tilda-shared-{j}.min.js') for j in range(1, settings.shared_assets, 2)]
+        else:
+            self._send(404, b'unknown method', 'text/plain')
+            return
+        self._send(200, json.dumps({'status': 'FOUND', 'result': result}).encode(), 'application/json')
+
+    def _handle_cdn(self, path: str):
+        """Ассеты с ETag и поддержкой If-None-Match и Range (bytes=N-)"""
+        etag = f'"{path}-v1"'
+        if self.headers.get('If-None-Match') == etag:
+            self.server.count('not_modified')
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        payload = self.server.payload
+        byte_range = self.headers.get('Range', '')
+        if byte_range.startswith('bytes=') and byte_range.endswith('-') \
+                and self.headers.get('If-Range', etag) == etag:
+            start = int(byte_range[len('bytes='):-1])
+            if start >= len(payload):
+                self._send(416, b'', 'text/plain', {'Content-Range': f'bytes */{len(payload)}'})
+                return
+            self.server.count('ranges')
+            self.server.count('cdn_bytes', len(payload) - start)
+            self._send(206, payload[start:], 'application/octet-stream', {
+                'ETag': etag, 'Content-Range': f'bytes {start}-{len(payload) - 1}/{len(payload)}'
+            })
+            return
+        self.server.count('cdn_bytes', len(payload))
+        self._send(200, payload, 'application/octet-stream', {'ETag': etag})
+
+    def _page(self, index: int) -> dict:
+        return {
+            'id': str(1000 + index),
+            'title': f'Page {index}',
+            'filename': f'page{1000 + index}.html',
+            'published': '1700000000'
+        }
+
+    def _asset(self, name: str) -> dict:
+        host, port = self.server.server_address[:2]
+        return {'from': f'http://{host}:{port}/cdn/{name}', 'to': name}
+
+    def _send(self, status: int, body: bytes, content_type: str, headers: Optional[dict] = None):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class MockTildaServer(ThreadingHTTPServer):
+    """HTTP-сервер имитации со счетчиками запросов"""
+    daemon_threads = True
+
+    def __init__(self, settings: MockSettings, port: int = 0):
+        super().__init__(('127.0.0.1', port), MockTildaHandler)
+        self.settings = settings
+        self.payload = b'\0' * settings.asset_size
+        self.html = '<html><body>' + 'x' * settings.html_size + '</body></html>'
+        self.stats = {}
+        self._random = random.Random(settings.seed)
+        self._lock = threading.Lock()
+
+    def count(self, key: str, value: int = 1) -> None:
+        with self._lock:
+            self.stats[key] = self.stats.get(key, 0) + value
+
+    def should_fail(self) -> bool:
+        with self._lock:
+            return self._random.random() < self.settings.error_rate
+
+
+def _serve(settings_json: str, port_queue: multiprocessing.Queue) -> None:
+    server = MockTildaServer(MockSettings.model_validate_json(settings_json))
+    port_queue.put(server.server_address[1])
+    server.serve_forever()
+
+
+class MockTilda:
+    """Запуск имитации в отдельном процессе, чтобы она не влияла на замеры экспортера"""
+
+    def __init__(self, settings: MockSettings):
+        self.settings = settings
+        self.port: Optional[int] = None
+        self._process: Optional[multiprocessing.Process] = None
+
+    @property
+    def url(self) -> str:
+        return f'http://127.0.0.1:{self.port}'
+
+    def start(self) -> 'MockTilda':
+        port_queue = multiprocessing.Queue()
+        self._process = multiprocessing.Process(
+            target=_serve, args=(self.settings.model_dump_json(), port_queue), daemon=True
+        )
+        self._process.start()
+        self.port = port_queue.get(timeout=10)
+        return self
+
+    def stats(self) -> dict:
+        """Счетчики запросов, накопленные сервером"""
+        with urlopen(f'{self.url}/__stats') as response:
+            return json.loads(response.read())
+
+    def stop(self) -> None:
+        if self._process is not None:
+            self._process.terminate()
+            self._process.join()
+            self._process = None
+
+    def __enter__(self) -> 'MockTilda':
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
@@ -0,0 +1,152 @@
+"""Бенчмарк экспорта против локальной имитации Tilda (без доступа к сети).
+
+Пример:
+    python -m bench.run_benchmark --pages 100 --assets-per-page 15 --api-latency 0.1 --runs 2
+"""
+import argparse
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from bench.mock_tilda import MockSettings, MockTilda
+
+
+# Счетчики имитации, которые уточняют запросы к CDN и API, а не добавляют новые
+SUB_COUNTERS = ('not_modified', 'ranges', 'errors', 'cdn_bytes')
+
+
+def _peak_rss_mb() -> float:
+    """Пиковый RSS процесса в МБ (ru_maxrss в КБ на Linux и в байтах на macOS)"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def _stats_delta(before: dict, after: dict) -> dict:
+    return {key: after[key] - before.get(key, 0) for key in after if after[key] - before.get(key, 0)}
+
+
+async def _run_once(project_id: str) -> dict:
+    """Один полный экспорт свежим экземпляром экспортера (манифест берется с диска)"""
+    from internal.config import TildaConfig
+    from internal.tilda_exporter import TildaExporter
+
+    exporter = TildaExporter(TildaConfig())
+    started = time.perf_counter()
+    try:
+        run = await exporter.extract_project(project_id)
+    finally:
+        await exporter.close()
+    wall = time.perf_counter() - started
+
+    return {
+        'wall_time': round(wall, 3),
+        'pages': run.pages_exported,
+        'failed_pages': len(run.failed_pages),
+        'pages_per_second': round(run.pages_exported / wall, 2) if wall else None,
+        'files_downloaded': run.files_downloaded,
+        'bytes_downloaded': run.bytes_downloaded,
+        'mb_per_second': round(run.bytes_downloaded / wall / 1024 / 1024, 2) if wall else None,
+        'cache_hits': run.cache_hits,
+        'phases': {name: round(seconds, 3) for name, seconds in run.phases.items()},
+    }
+
+
+def _measure(project_id: str, log_level: int) -> dict:
+    """Экспорт в отдельном процессе: пиковый RSS относится только к этому запуску"""
+    logging.basicConfig(level=log_level)
+    result = asyncio.run(_run_once(project_id))
+    result['peak_rss_mb'] = round(_peak_rss_mb(), 1)
+    return result
+
+
+def run_benchmark(settings: MockSettings, runs: int, overrides: dict) -> dict:
+    """Запуск имитации и серии экспортов; возвращает отчет"""
+    report = {'settings': settings.model_dump(), 'overrides': overrides, 'runs': []}
+    with MockTilda(settings) as mock, tempfile.TemporaryDirectory(prefix='tilda-bench-') as output:
+        os.environ.update({
+            'TILDA_PUBLIC_KEY': 'bench',
+            'TILDA_SECRET_KEY': 'bench',
+            'TILDA_PROJECT_ID': '1',
+            'TILDA_API_URL': f'{mock.url}/v1/',
+            'TILDA_STATIC_PATH_PREFIX': str(Path(output)) + '/',
+            **overrides
+        })
+        for _ in range(runs):
+            before = mock.stats()
+            # ru_maxrss - максимум за всю жизнь процесса (и по всем дочерним), поэтому каждый
+            # запуск идет в новом процессе, который сообщает свой пик сам
+            with ProcessPoolExecutor(1, mp_context=multiprocessing.get_context('spawn')) as executor:
+                result = executor.submit(_measure, '1', logging.getLogger().level).result()
+            result['requests'] = _stats_delta(before, mock.stats())
+            report['runs'].append(result)
+    return report
+
+
+def _print_report(report: dict) -> None:
+    for number, result in enumerate(report['runs'], 1):
+        requests = result['requests']
+        # Запросы - это обращения к CDN и методам API; остальные счетчики уточняют их
+        total = sum(v for k, v in requests.items() if k == 'cdn' or k.startswith('api_'))
+        details = ', '.join(f'{key} {requests[key]}' for key in SUB_COUNTERS[:-1] if requests.get(key))
+        print(
+            f"run {number}: {result['wall_time']:.2f} s, {result['pages']} pages "
+            f"({result['pages_per_second']} pages/s, {result['failed_pages']} failed), "
+            f"{result['files_downloaded']} files / {result['bytes_downloaded'] / 1024 / 1024:.1f} MB "
+            f"({result['mb_per_second']} MB/s), cache hits {result['cache_hits']}, "
+            f"requests {total} ({', '.join(f'{k} {v}' for k, v in requests.items() if k not in SUB_COUNTERS)})"
+            f"{f', of them {details}' if details else ''}, "
+            f"peak RSS {result['peak_rss_mb']} MB"
+        )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    defaults = MockSettings()
+    parser.add_argument('--pages', type=int, default=defaults.pages)
+    parser.add_argument('--assets-per-page', type=int, default=defaults.assets_per_page)
+    parser.add_argument('--shared-assets', type=int, default=defaults.shared_assets)
+    parser.add_argument('--asset-size', type=int, default=defaults.asset_size, help='байт')
+    parser.add_argument('--html-size', type=int, default=defaults.html_size, help='байт')
+    parser.add_argument('--api-latency', type=float, default=defaults.api_latency, help='секунд')
+    parser.add_argument('--cdn-latency', type=float, default=defaults.cdn_latency, help='секунд')
+    parser.add_argument('--error-rate', type=float, default=defaults.error_rate, help='доля ответов 500')
+    parser.add_argument('--seed', type=int, default=defaults.seed)
+    parser.add_argument('--runs', type=int, default=2, help='повторы (со 2-го работает кэш ассетов)')
+    parser.add_argument('--set', action='append', default=[], metavar='KEY=VALUE',
+                        help='переменная окружения экспортера, например TILDA_PAGE_CONCURRENCY=8')
+    parser.add_argument('--json', type=Path, help='сохранить отчет в JSON')
+    parser.add_argument('--verbose', action='store_true', help='логи экспортера')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING)
+    settings = MockSettings(
+        pages=args.pages,
+        assets_per_page=args.assets_per_page,
+        shared_assets=args.shared_assets,
+        asset_size=args.asset_size,
+        html_size=args.html_size,
+        api_latency=args.api_latency,
+        cdn_latency=args.cdn_latency,
+        error_rate=args.error_rate,
+        seed=args.seed
+    )
+    # По умолчанию снимаем ограничение частоты API, чтобы мерить сам экспортер
+    overrides = {'TILDA_API_RATE': '1000', 'TILDA_API_BURST': '1000'}
+    overrides.update(item.split('=', 1) for item in args.set)
+
+    report = run_benchmark(settings, args.runs, overrides)
+    _print_report(report)
+    if args.json:
+        args.json.write_text(json.dumps(report, indent=2), encoding='utf-8')
+
+
+if __name__ == '__main__':
+    main()
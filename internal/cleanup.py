@@ -0,0 +1,105 @@
+import logging
+import shutil
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Iterable, List, Optional, Set
+
+from internal.compressor import SIDECAR_SUFFIXES
+from internal.config import TildaConfig
+from internal.manifest import ExportManifest
+from internal.storage import SnapshotStorage
+
+logger = logging.getLogger(__name__)
+
+
+class OrphanCollector:
+    """Удаление файлов экспорта, на которые больше не ссылается ни одна страница.
+
+    Файл без ссылок сначала запоминается в манифесте и удаляется (или переносится
+    в карантин) только после TILDA_GC_GRACE секунд без ссылок.
+    """
+
+    def __init__(self, config: TildaConfig, storage: SnapshotStorage):
+        self.config = config
+        self.storage = storage
+        self.quarantine_path = config.state_path / 'quarantine'
+
+    @property
+    def enabled(self) -> bool:
+        return self.config.gc_action in ('delete', 'quarantine')
+
+    def collect(
+        self, manifest: ExportManifest, root: Optional[Path], removed_html: Iterable[Path] = ()
+    ) -> Set[Path]:
+        """Проход сборщика после экспорта. Возвращает удаленные пути (для коммита)"""
+        if not self.enabled:
+            return set()
+
+        now = time.time()
+        html_dir = self.config.get_path('html')
+        live_html = {str(html_dir / page['filename']) for page in manifest.pages.values()}
+        # HTML удаленных и переименованных страниц
+        for path in removed_html:
+            if str(path) not in live_html:
+                manifest.orphans.setdefault(str(path), now)
+
+        referenced = manifest.referenced_assets()
+        if referenced is None:
+            logger.info("Индекс ссылок на ассеты неполный, очистка отложена до полного экспорта")
+            return set()
+        referenced |= live_html
+        for path in manifest.assets.keys() - referenced:
+            manifest.orphans.setdefault(path, now)
+        for path in [p for p in manifest.orphans if p in referenced]:
+            del manifest.orphans[path]
+
+        removed = set()
+        for path, since in list(manifest.orphans.items()):
+            if now - since < self.config.gc_grace:
+                continue
+            record = manifest.assets.pop(path, None)
+            removed.update(self._remove(Path(path), record.variants if record else [], root))
+            del manifest.orphans[path]
+            # Контрольные суммы удаленного файла, его сжатых копий и вариантов
+            for file_path in [p for p, file in manifest.files.items() if path in (p, file.source)]:
+                del manifest.files[file_path]
+
+        if removed:
+            logger.info(f"Удалено файлов без ссылок: {len(removed)}")
+        self._prune_quarantine(now)
+        return removed
+
+    def _remove(self, path: Path, variants: List[str], root: Optional[Path]) -> Set[Path]:
+        """Удаление файла вместе со сжатыми копиями и вариантами изображения"""
+        related = [path.with_name(path.name + suffix) for suffix in SIDECAR_SUFFIXES.values()]
+        related += [path.with_name(name) for name in variants]
+        removed = set()
+        for logical in [path] + related:
+            target = self.storage.resolve(logical, root)
+            if not target.exists():
+                continue
+            if self.config.gc_action == 'quarantine':
+                self._quarantine(logical, target)
+            else:
+                target.unlink()
+            removed.add(logical)
+        return removed
+
+    def _quarantine(self, logical: Path, target: Path) -> None:
+        """Перенос файла в карантин (TILDA_STATE_PATH/quarantine/<дата>/...)"""
+        try:
+            relative = logical.relative_to(self.storage.base)
+        except ValueError:
+            relative = Path(logical.name)
+        destination = self.quarantine_path / datetime.now().strftime('%Y%m%d') / relative
+        destination.parent.mkdir(parents=True, exist_ok=True)
+        shutil.move(target, destination)
+
+    def _prune_quarantine(self, now: float) -> None:
+        """Удаление карантина старше TILDA_GC_GRACE"""
+        if not self.quarantine_path.exists():
+            return
+        for day in self.quarantine_path.iterdir():
+            if day.is_dir() and now - day.stat().st_mtime >= self.config.gc_grace:
+                shutil.rmtree(day, ignore_errors=True)
@@ -0,0 +1,111 @@
+import asyncio
+import gzip
+import hashlib
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from internal.config import TildaConfig
+from internal.storage import atomic_write_bytes
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+# Типы файлов, для которых создаются сжатые копии
+COMPRESSIBLE_SUFFIXES = ('.html', '.htm', '.css', '.js', '.mjs', '.json', '.svg', '.xml', '.txt')
+# Формат -> расширение сжатой копии
+SIDECAR_SUFFIXES = {'gzip': '.gz', 'br': '.br'}
+
+
+def sidecar_path(path: Path, fmt: str) -> Path:
+    """Путь сжатой копии файла (style.css -> style.css.gz)"""
+    return path.with_name(path.name + SIDECAR_SUFFIXES[fmt])
+
+
+def compress_file(
+    path: Path, formats: Tuple[str, ...], gzip_level: int, brotli_quality: int, min_size: int
+) -> Dict[str, Optional[Tuple[int, str]]]:
+    """Запись сжатых копий файла (выполняется в процессе пула).
+
+    Копия, которая не меньше исходного файла, удаляется, чтобы nginx не отдал устаревшую версию.
+    Возвращает для каждого формата размер и SHA-256 записанной копии (None - копия удалена).
+    """
+    data = path.read_bytes()
+    written = {}
+    for fmt in formats:
+        target = sidecar_path(path, fmt)
+        try:
+            compressed = None
+            if len(data) >= min_size:
+                if fmt == 'gzip':
+                    # mtime=0: одинаковое содержимое дает одинаковый .gz (для git и ETag)
+                    compressed = gzip.compress(data, compresslevel=gzip_level, mtime=0)
+                else:
+                    compressed = brotli.compress(data, quality=brotli_quality)
+            if compressed is not None and len(compressed) < len(data):
+                atomic_write_bytes(target, compressed)
+                written[fmt] = (len(compressed), hashlib.sha256(compressed).hexdigest())
+            else:
+                target.unlink(missing_ok=True)
+                written[fmt] = None
+        except BaseException:
+            target.unlink(missing_ok=True)
+            raise
+    return written
+
+
+class Precompressor:
+    """Создание .gz/.br копий текстовых файлов экспорта для gzip_static/brotli_static"""
+
+    # Пул процессов общий для всех проектов
+    _executor: Optional[ProcessPoolExecutor] = None
+
+    def __init__(self, config: TildaConfig):
+        self.config = config
+        formats = list(config.compress_formats)
+        if 'br' in formats and brotli is None:
+            logger.warning("Пакет brotli не установлен, .br файлы создаваться не будут")
+            formats.remove('br')
+        self.formats = tuple(formats)
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.formats)
+
+    @property
+    def executor(self) -> ProcessPoolExecutor:
+        """Пул процессов (создается при первом обращении)"""
+        if Precompressor._executor is None:
+            Precompressor._executor = ProcessPoolExecutor(max_workers=self.config.compress_workers)
+        return Precompressor._executor
+
+    def sidecars(self, path: Path) -> List[Path]:
+        """Сжатые копии, которые должны лежать рядом с файлом"""
+        if not self.enabled or path.suffix.lower() not in COMPRESSIBLE_SUFFIXES:
+            return []
+        return [sidecar_path(path, fmt) for fmt in self.formats]
+
+    def needs_update(self, path: Path, changed: bool) -> bool:
+        """Нужно ли пересжимать файл: он изменился или копий еще нет (маленькие файлы не сжимаются)"""
+        sidecars = self.sidecars(path)
+        if not sidecars or changed:
+            return bool(sidecars)
+        return path.stat().st_size >= self.config.compress_min_size and not all(p.exists() for p in sidecars)
+
+    async def compress(self, path: Path) -> Dict[str, Optional[Tuple[int, str]]]:
+        """Сжатие файла в пуле процессов; возвращает размер и SHA-256 копий по форматам"""
+        return await asyncio.get_running_loop().run_in_executor(
+            self.executor, compress_file, path, self.formats,
+            self.config.gzip_level, self.config.brotli_quality, self.config.compress_min_size
+        )
+
+    def close(self) -> None:
+        """Остановка пула процессов"""
+        if Precompressor._executor is not None:
+            Precompressor._executor.shutdown(cancel_futures=True)
+            Precompressor._executor = None
@@ -1,43 +1,181 @@
 import os
 from pathlib import Path
+from typing import Optional
 from dotenv import load_dotenv
 
 load_dotenv()
 
 class TildaConfig:
-    """Конфигурация для работы с Tilda API"""
-    def __init__(self):
+    """Конфигурация для работы с Tilda API.
+
+    Без project_id - общая конфигурация сервера, с project_id - конфигурация проекта:
+    ключи, пути, снапшоты и Git можно переопределить переменными TILDA_PROJECT_<id>_<имя>.
+    """
+    def __init__(self, project_id: Optional[str] = None):
+        self._scope = project_id
+        # Проекты, которые обслуживает сервер (TILDA_PROJECTS=id1,id2 или один TILDA_PROJECT_ID)
+        self.project_ids = [
+            p.strip() for p in os.environ.get('TILDA_PROJECTS', '').split(',') if p.strip()
+        ] or [p for p in [os.environ.get('TILDA_PROJECT_ID')] if p]
+        multi_project = len(self.project_ids) > 1
+
         # API ключи
-        self.public_key = os.environ.get('TILDA_PUBLIC_KEY')
-        self.secret_key = os.environ.get('TILDA_SECRET_KEY')
-        self.project_id = os.environ.get('TILDA_PROJECT_ID')
+        self.public_key = self._env('TILDA_PUBLIC_KEY')
+        self.secret_key = self._env('TILDA_SECRET_KEY')
+        self.project_id = project_id or (self.project_ids[0] if self.project_ids else None)
         
         # Настройки сервера
         self.host = os.environ.get('TILDA_HOST', '0.0.0.0')
         self.port = int(os.environ.get('TILDA_PORT', 8000))
+        # Токен для служебных эндпоинтов (без него они отключены)
+        self.admin_token = os.environ.get('TILDA_ADMIN_TOKEN')
+        # Режим запуска: warm - сервер готов сразу, устаревшие страницы обновляются в фоне;
+        # blocking - полный экспорт до начала приема запросов
+        self.startup_mode = os.environ.get('TILDA_STARTUP_MODE', 'warm').lower()
+        self.startup_retry_delay = float(os.environ.get('TILDA_STARTUP_RETRY_DELAY', 60))
+        # Встроенная раздача экспорта (кэш небольших файлов в памяти, большие читаются с диска)
+        self.serve = os.environ.get('TILDA_SERVE', 'false').lower() == 'true'
+        self.serve_root = os.environ.get('TILDA_SERVE_ROOT')
+        self.serve_cache_size = int(os.environ.get('TILDA_SERVE_CACHE_SIZE', 64 * 1024 * 1024))
+        self.serve_cache_file_limit = int(os.environ.get('TILDA_SERVE_CACHE_FILE_LIMIT', 1024 * 1024))
+        self.serve_max_age = int(os.environ.get('TILDA_SERVE_MAX_AGE', 3600))
+        # Файл для JSON-записей о длительности экспортов (JSON Lines, необязательно)
+        timing_log = os.environ.get('TILDA_TIMING_LOG')
+        self.timing_log_path = Path(timing_log) if timing_log else None
         
-        # Базовые пути
+        # Базовые пути. При нескольких проектах каждый по умолчанию пишет в свой подкаталог,
+        # а общие TILDA_*_PATH не наследуются, чтобы проекты не перезаписывали файлы друг друга
         self.base_path = os.environ.get('TILDA_STATIC_PATH_PREFIX', 'static/')
+        inherit_paths = not (project_id and multi_project)
+        if not inherit_paths:
+            self.base_path = self._env('TILDA_STATIC_PATH_PREFIX', inherit=False) or f'{self.base_path}{project_id}/'
         self.paths = {
-            'html': Path(os.environ.get('TILDA_HTML_PATH', self.base_path)),
-            'images': Path(os.environ.get('TILDA_IMAGES_PATH', self.base_path + 'images/')),
-            'css': Path(os.environ.get('TILDA_CSS_PATH', self.base_path + 'css/')),
-            'js': Path(os.environ.get('TILDA_JS_PATH', self.base_path + 'js/'))
+            'html': Path(self._env('TILDA_HTML_PATH', inherit=inherit_paths) or self.base_path),
+            'images': Path(self._env('TILDA_IMAGES_PATH', inherit=inherit_paths) or self.base_path + 'images/'),
+            'css': Path(self._env('TILDA_CSS_PATH', inherit=inherit_paths) or self.base_path + 'css/'),
+            'js': Path(self._env('TILDA_JS_PATH', inherit=inherit_paths) or self.base_path + 'js/')
         }
+        # Служебное состояние экспорта (манифест)
+        self.state_path = Path(self._env('TILDA_STATE_PATH', inherit=inherit_paths) or self.base_path + '.tilda/')
+
+        # Версионированные снапшоты: base_path/releases/<версия> и симлинк base_path/current
+        self.snapshots = self._env('TILDA_SNAPSHOTS', 'false').lower() == 'true'
+        self.snapshot_keep = int(self._env('TILDA_SNAPSHOT_KEEP', 3))
+
+        # Настройки Tilda API
+        self.api_url = os.environ.get('TILDA_API_URL', 'https://api.tildacdn.info/v1/')
+        self.api_timeout = float(os.environ.get('TILDA_API_TIMEOUT', 30))
+        self.api_retries = int(os.environ.get('TILDA_API_RETRIES', 4))
+        self.api_backoff = float(os.environ.get('TILDA_API_BACKOFF', 0.5))
+        self.api_backoff_max = float(os.environ.get('TILDA_API_BACKOFF_MAX', 30))
+        self.api_rate = float(os.environ.get('TILDA_API_RATE', 2))
+        self.api_burst = int(os.environ.get('TILDA_API_BURST', 10))
+        self.api_cache_ttl = float(os.environ.get('TILDA_API_CACHE_TTL', 10))
+
+        # Настройки загрузки ассетов
+        self.download_concurrency = int(os.environ.get('TILDA_DOWNLOAD_CONCURRENCY', 16))
+        self.download_per_host = int(os.environ.get('TILDA_DOWNLOAD_PER_HOST', 8))
+        self.download_chunk_size = int(os.environ.get('TILDA_DOWNLOAD_CHUNK_SIZE', 256 * 1024))
+        self.download_timeout = float(os.environ.get('TILDA_DOWNLOAD_TIMEOUT', 60))
+        # Повторы прерванной загрузки и ответов 429/5xx (продолжаются с места остановки запросом Range)
+        self.download_retries = int(os.environ.get('TILDA_DOWNLOAD_RETRIES', 3))
+        self.download_retry_delay = float(os.environ.get('TILDA_DOWNLOAD_RETRY_DELAY', 1))
+        self.download_retry_max_delay = float(os.environ.get('TILDA_DOWNLOAD_RETRY_MAX_DELAY', 30))
+        # Считать ETag из 32 hex-символов MD5 содержимого (так его формируют S3-совместимые хранилища)
+        self.download_etag_md5 = os.environ.get('TILDA_DOWNLOAD_ETAG_MD5', 'false').lower() == 'true'
+        # Число файлов, которые хешируются одновременно при проверке экспорта (python main.py verify)
+        verify_workers = os.environ.get('TILDA_VERIFY_WORKERS')
+        self.verify_workers = int(verify_workers) if verify_workers else os.cpu_count() or 4
+
+        # Настройки экспорта страниц
+        self.page_concurrency = int(self._env('TILDA_PAGE_CONCURRENCY', 4))
+        self.page_retries = int(os.environ.get('TILDA_PAGE_RETRIES', 2))
+        self.page_retry_delay = float(os.environ.get('TILDA_PAGE_RETRY_DELAY', 2))
+        # Разбор getpagefullexport по мере получения ответа: HTML сразу пишется на диск
+        self.stream_export = os.environ.get('TILDA_STREAM_EXPORT', 'false').lower() == 'true'
+        # Наибольший размер поля ответа, которое собирается в памяти при потоковом разборе (символы)
+        self.stream_buffer_limit = int(os.environ.get('TILDA_STREAM_BUFFER_LIMIT', 1024 * 1024))
+
+        # Сжатые копии (.gz/.br) текстовых файлов для gzip_static/brotli_static
+        self.compress_formats = [
+            f.strip() for f in os.environ.get('TILDA_COMPRESS', 'gzip,br').lower().split(',') if f.strip()
+        ]
+        self.gzip_level = int(os.environ.get('TILDA_GZIP_LEVEL', 9))
+        self.brotli_quality = int(os.environ.get('TILDA_BROTLI_QUALITY', 11))
+        self.compress_min_size = int(os.environ.get('TILDA_COMPRESS_MIN_SIZE', 256))
+        compress_workers = os.environ.get('TILDA_COMPRESS_WORKERS')
+        self.compress_workers = int(compress_workers) if compress_workers else None
+
+        # Фоновая оптимизация изображений (нужен Pillow)
+        self.image_optimize = os.environ.get('TILDA_IMAGE_OPTIMIZE', 'false').lower() == 'true'
+        self.image_formats = [
+            f.strip() for f in os.environ.get('TILDA_IMAGE_FORMATS', 'webp').lower().split(',') if f.strip()
+        ]
+        self.image_widths = sorted(
+            int(w) for w in os.environ.get('TILDA_IMAGE_WIDTHS', '').split(',') if w.strip()
+        )
+        self.image_quality = int(os.environ.get('TILDA_IMAGE_QUALITY', 80))
+        image_workers = os.environ.get('TILDA_IMAGE_WORKERS')
+        self.image_workers = int(image_workers) if image_workers else None
+
+        # Очистка файлов без ссылок: delete, quarantine или off
+        self.gc_action = os.environ.get('TILDA_GC', 'delete').lower()
+        self.gc_grace = float(os.environ.get('TILDA_GC_GRACE', 24 * 3600))
+
+        # Число проектов, экспортируемых одновременно (API и CDN при этом общие)
+        self.project_concurrency = int(os.environ.get('TILDA_PROJECT_CONCURRENCY', 4))
+
+        # Склейка вебхуков
+        self.webhook_debounce = float(os.environ.get('TILDA_WEBHOOK_DEBOUNCE', 3))
+        self.webhook_max_delay = float(os.environ.get('TILDA_WEBHOOK_MAX_DELAY', 30))
+        self.incremental_page_limit = int(os.environ.get('TILDA_INCREMENTAL_PAGE_LIMIT', 10))
+
+        # Журнал заданий экспорта (SQLite): задания и чекпоинты страниц переживают перезапуск
+        self.queue_path = Path(os.environ.get('TILDA_QUEUE_PATH', self.state_path / 'queue.sqlite3'))
+        # Журнал на сетевом томе, общем для нескольких хостов: WAL там не работает (нет общей памяти wal-index)
+        self.queue_shared = os.environ.get('TILDA_QUEUE_SHARED', 'false').lower() == 'true'
+        # Сколько завершенных заданий хранить для просмотра
+        self.queue_history = int(os.environ.get('TILDA_QUEUE_HISTORY', 100))
+        # Повтор задания, прерванного недоступностью Tilda API или сети: задержка удваивается до максимума (секунды)
+        self.job_retry_delay = float(os.environ.get('TILDA_JOB_RETRY_DELAY', 30))
+        self.job_retry_max_delay = float(os.environ.get('TILDA_JOB_RETRY_MAX_DELAY', 900))
+        # Как часто процесс проверяет, не освободился ли проект, и забирает задания других процессов (секунды)
+        self.leader_poll = float(os.environ.get('TILDA_LEADER_POLL', 5))
 
         # Настройки Git
-        self.push_to_git = os.environ.get('PUSH_TO_GIT', 'false').lower() == 'true'
-        self.git_username = os.environ.get('GIT_USERNAME')
-        self.git_password = os.environ.get('GIT_PASSWORD')
-        self.git_remote_url = os.environ.get('GIT_REMOTE_URL')
+        self.push_to_git = self._env('PUSH_TO_GIT', 'false').lower() == 'true'
+        self.git_username = self._env('GIT_USERNAME')
+        self.git_password = self._env('GIT_PASSWORD') or self._env('GIT_TOKEN')
+        self.git_remote_url = self._env('GIT_REMOTE_URL')
         self.git_config_name = os.environ.get('GIT_CONFIG_NAME', 'Tilda Exporter')
         self.git_config_email = os.environ.get('GIT_CONFIG_EMAIL', 'tilda-exporter@example.com')
+        # Изменения экспортов за это время объединяются в один коммит (секунды)
+        self.git_batch_delay = float(os.environ.get('GIT_BATCH_DELAY', 10))
         
+    def _env(self, name: str, default=None, inherit: bool = True):
+        """Значение переменной окружения; для проекта сначала ищется TILDA_PROJECT_<id>_<имя>"""
+        if self._scope:
+            value = os.environ.get(f"TILDA_PROJECT_{self._scope}_{name.removeprefix('TILDA_')}")
+            if value is not None:
+                return value
+        return os.environ.get(name, default) if inherit else default
+
+    def for_project(self, project_id: str) -> 'TildaConfig':
+        """Конфигурация отдельного проекта"""
+        return TildaConfig(project_id)
+
     @property
     def is_valid(self) -> bool:
         """Проверка валидности конфигурации"""
+        if self._scope is None:
+            return bool(self.project_ids) and all(self.for_project(p).is_valid for p in self.project_ids)
         return bool(self.public_key and self.secret_key and self.project_id)
     
+    @property
+    def manifest_path(self) -> Path:
+        """Путь к манифесту последнего экспорта"""
+        return self.state_path / 'manifest.json'
+
     def get_path(self, asset_type: str) -> Path:
         """Получение пути для определенного типа файлов"""
-        return self.paths.get(asset_type, self.paths['html'])
\ No newline at end of file
+        return self.paths.get(asset_type, self.paths['html'])
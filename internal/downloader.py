@@ -0,0 +1,336 @@
+import asyncio
+import base64
+import binascii
+import contextlib
+import hashlib
+import json
+import logging
+import os
+import random
+import re
+from collections import OrderedDict, deque
+from pathlib import Path
+from typing import AsyncIterator, Deque, Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+import httpx
+
+from internal.config import TildaConfig
+from internal.manifest import AssetRecord
+from internal.metrics import ASSET_CACHE, DOWNLOADED_BYTES, DOWNLOADED_FILES
+from internal.tilda_api import RETRY_STATUSES
+
+logger = logging.getLogger(__name__)
+
+# ETag S3-совместимых хранилищ для файлов, загруженных одним запросом, - MD5 содержимого
+MD5_ETAG = re.compile(r'^(?:W/)?"?([0-9a-fA-F]{32})"?$')
+
+
+class DownloadIntegrityError(Exception):
+    """Полученный файл не совпадает с Content-Length или контрольной суммой сервера"""
+
+
+def part_path(path: Path) -> Path:
+    """Недокачанный файл рядом с целевым (загрузка продолжается с его конца)"""
+    return path.with_name(f'.{path.name}.part')
+
+
+def _part_meta_path(path: Path) -> Path:
+    """URL и валидатор (ETag/Last-Modified) ответа, к которому относится .part файл"""
+    return path.with_name(f'.{path.name}.part.json')
+
+
+def _read_into(path: Path, hashers: List['hashlib._Hash'], chunk_size: int = 1024 * 1024) -> int:
+    """Хеширование уже скачанной части файла. Возвращает ее размер"""
+    size = 0
+    with open(path, 'rb') as f:
+        while chunk := f.read(chunk_size):
+            size += len(chunk)
+            for hasher in hashers:
+                hasher.update(chunk)
+    return size
+
+
+def _header_digests(headers: httpx.Headers, partial: bool) -> Dict[str, str]:
+    """Контрольные суммы всего файла из заголовков ответа: алгоритм -> hex"""
+    digests = {}
+    # Digest (RFC 3230) и Repr-Digest (RFC 9530) относятся ко всему файлу, а не к диапазону
+    for header in ('digest', 'repr-digest'):
+        for item in headers.get(header, '').split(','):
+            name, _, value = item.strip().partition('=')
+            algorithm = {'sha-256': 'sha256', 'md5': 'md5'}.get(name.lower())
+            if algorithm and value:
+                try:
+                    digests[algorithm] = base64.b64decode(value.strip(':')).hex()
+                except (binascii.Error, ValueError):
+                    pass
+    # Content-MD5 - сумма тела ответа, для 206 это только диапазон
+    if not partial and headers.get('content-md5'):
+        try:
+            digests['md5'] = base64.b64decode(headers['content-md5']).hex()
+        except (binascii.Error, ValueError):
+            pass
+    return digests
+
+
+class FairSemaphore:
+    """Семафор с очередью на каждый ключ (проект).
+
+    Освободившийся слот получает следующий по кругу ключ, поэтому проект с длинной
+    очередью загрузок не задерживает остальные.
+    """
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self._used = 0
+        self._queues: 'OrderedDict[str, Deque[asyncio.Future]]' = OrderedDict()
+
+    async def acquire(self, key: str) -> None:
+        """Ожидание слота в очереди ключа"""
+        if self._used < self.capacity and not self._queues:
+            self._used += 1
+            return
+        future = asyncio.get_running_loop().create_future()
+        self._queues.setdefault(key, deque()).append(future)
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.cancelled():
+                queue = self._queues.get(key)
+                if queue is not None and future in queue:
+                    queue.remove(future)
+                    if not queue:
+                        del self._queues[key]
+            else:
+                # Слот уже был передан этой задаче
+                self.release()
+            raise
+
+    def release(self) -> None:
+        """Передача слота следующему ключу по кругу"""
+        while self._queues:
+            key, queue = next(iter(self._queues.items()))
+            future = queue.popleft()
+            if queue:
+                self._queues.move_to_end(key)
+            else:
+                del self._queues[key]
+            if not future.done():
+                future.set_result(None)
+                return
+        self._used -= 1
+
+    @contextlib.asynccontextmanager
+    async def limit(self, key: str) -> AsyncIterator[None]:
+        await self.acquire(key)
+        try:
+            yield
+        finally:
+            self.release()
+
+
+class AssetDownloader:
+    """Асинхронная загрузка ассетов через общий пул соединений.
+
+    Один загрузчик может обслуживать несколько проектов: лимиты соединений общие,
+    а слоты распределяются между проектами по очереди.
+    """
+
+    def __init__(self, config: TildaConfig):
+        self.config = config
+        self._client: Optional[httpx.AsyncClient] = None
+        self._global_limit = FairSemaphore(config.download_concurrency)
+        self._host_limits: Dict[str, FairSemaphore] = {}
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        """Общий клиент с keep-alive соединениями (создается при первом обращении)"""
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                limits=httpx.Limits(
+                    max_connections=self.config.download_concurrency,
+                    max_keepalive_connections=self.config.download_concurrency
+                ),
+                timeout=httpx.Timeout(self.config.download_timeout),
+                follow_redirects=True
+            )
+        return self._client
+
+    def _host_limit(self, url: str) -> FairSemaphore:
+        """Семафор, ограничивающий число одновременных загрузок с одного хоста"""
+        host = urlsplit(url).netloc
+        if host not in self._host_limits:
+            self._host_limits[host] = FairSemaphore(self.config.download_per_host)
+        return self._host_limits[host]
+
+    def _backoff(self, attempt: int) -> float:
+        """Экспоненциальная задержка с полным джиттером (как у запросов к API)"""
+        return random.uniform(
+            0, min(self.config.download_retry_max_delay, self.config.download_retry_delay * 2 ** attempt)
+        )
+
+    @staticmethod
+    def _has_cached_copy(source_url: str, local_path: Path, cached: Optional[AssetRecord]) -> bool:
+        """Совпадает ли локальный файл с записью в кэше"""
+        if cached is None or cached.url != source_url:
+            return False
+        try:
+            return local_path.stat().st_size == (cached.stored_size or cached.size)
+        except FileNotFoundError:
+            return False
+
+    async def download(
+        self, source_url: str, local_path: Path, cached: Optional[AssetRecord] = None, owner: str = ''
+    ) -> Tuple[AssetRecord, bool, int]:
+        """Потоковая загрузка файла на диск через временный файл.
+
+        Возвращает запись для манифеста, признак того, что содержимое файла изменилось,
+        и число полученных байт (0, если сервер ответил 304). owner - проект, в очереди
+        которого загрузка ждет свободного слота.
+        """
+        has_copy = self._has_cached_copy(source_url, local_path, cached)
+        # Сначала слот хоста: задачи в очереди к загруженному хосту не занимают общие слоты,
+        # нужные загрузкам с других хостов
+        async with self._host_limit(source_url).limit(owner), self._global_limit.limit(owner):
+            for attempt in range(self.config.download_retries + 1):
+                try:
+                    record, received = await self._fetch(source_url, local_path, cached if has_copy else None)
+                    break
+                except (httpx.TransportError, httpx.HTTPStatusError, DownloadIntegrityError) as e:
+                    # Из ошибок HTTP повторяются только временные: 429 и 5xx
+                    status = e.response.status_code if isinstance(e, httpx.HTTPStatusError) else None
+                    if attempt == self.config.download_retries or (status is not None and status not in RETRY_STATUSES):
+                        raise
+                    retry_after = e.response.headers.get('Retry-After') if status is not None else None
+                    delay = float(retry_after) if retry_after and retry_after.isdigit() else self._backoff(attempt)
+                    reason = f"HTTP {status}" if status is not None else repr(e)
+                    logger.warning(
+                        f"Загрузка {source_url} прервана ({reason}), попытка {attempt + 2} через {delay:.1f} с"
+                    )
+                    await asyncio.sleep(delay)
+
+        if record is cached:
+            ASSET_CACHE.labels('hit').inc()
+            return cached, False, 0
+        ASSET_CACHE.labels('miss').inc()
+        DOWNLOADED_FILES.inc()
+        changed = not has_copy or cached.sha256 != record.sha256
+        return record, changed, received
+
+    async def _fetch(
+        self, source_url: str, local_path: Path, cached: Optional[AssetRecord]
+    ) -> Tuple[AssetRecord, int]:
+        """Одна попытка загрузки в .part файл с проверкой и атомарным переименованием.
+
+        Если от прошлой попытки остался .part того же ответа, запрашивается только
+        недостающий диапазон (Range + If-Range). Возвращает запись (cached при 304)
+        и число полученных байт.
+        """
+        part = part_path(local_path)
+        offset, validator = self._resume_point(source_url, part)
+        if offset:
+            # Диапазон считается по несжатым байтам, поэтому сжатие при продолжении отключается
+            headers = {'Range': f'bytes={offset}-', 'If-Range': validator, 'Accept-Encoding': 'identity'}
+        else:
+            headers = {}
+            if cached is not None and cached.etag:
+                headers['If-None-Match'] = cached.etag
+            if cached is not None and cached.last_modified:
+                headers['If-Modified-Since'] = cached.last_modified
+
+        async with self.client.stream('GET', source_url, headers=headers) as response:
+            if response.status_code == 304 and cached is not None and not offset:
+                return cached, 0
+            if response.status_code == 416 and offset:
+                self._discard_part(part)
+                raise DownloadIntegrityError("сервер не принял диапазон, загрузка начнется заново")
+            response.raise_for_status()
+
+            partial = response.status_code == 206
+            if partial and not response.headers.get('content-range', '').startswith(f'bytes {offset}-'):
+                self._discard_part(part)
+                raise DownloadIntegrityError(f"неожиданный Content-Range: {response.headers.get('content-range')}")
+            if not partial:
+                # Сервер прислал файл целиком (файл изменился или Range не поддерживается)
+                offset = 0
+
+            encoded = response.headers.get('content-encoding', 'identity').lower() != 'identity'
+            expected_size, digests = None, {}
+            if not encoded:
+                if partial:
+                    total = response.headers['content-range'].rpartition('/')[2]
+                    expected_size = int(total) if total.isdigit() else None
+                elif response.headers.get('content-length', '').isdigit():
+                    expected_size = int(response.headers['content-length'])
+                digests = _header_digests(response.headers, partial)
+                etag_md5 = MD5_ETAG.match(response.headers.get('etag', ''))
+                if self.config.download_etag_md5 and etag_md5 and 'md5' not in digests:
+                    digests['md5'] = etag_md5.group(1).lower()
+
+            hashers = {'sha256': hashlib.sha256()}
+            if 'md5' in digests:
+                hashers['md5'] = hashlib.md5()
+            if offset:
+                await asyncio.to_thread(_read_into, part, list(hashers.values()))
+
+            # Без валидатора или при сжатии продолжить загрузку после обрыва нельзя
+            new_validator = response.headers.get('etag') or response.headers.get('last-modified')
+            if new_validator and not encoded:
+                _part_meta_path(part).write_text(json.dumps({'url': source_url, 'validator': new_validator}))
+            else:
+                _part_meta_path(part).unlink(missing_ok=True)
+
+            received = 0
+            with open(part, 'ab' if offset else 'wb') as f:
+                async for chunk in response.aiter_bytes(self.config.download_chunk_size):
+                    f.write(chunk)
+                    for hasher in hashers.values():
+                        hasher.update(chunk)
+                    received += len(chunk)
+                    DOWNLOADED_BYTES.inc(len(chunk))
+
+        size = offset + received
+        if expected_size is not None and size != expected_size:
+            self._discard_part(part)
+            raise DownloadIntegrityError(f"получено {size} байт вместо {expected_size}")
+        for algorithm, expected in digests.items():
+            if hashers[algorithm].hexdigest() != expected:
+                self._discard_part(part)
+                raise DownloadIntegrityError(f"контрольная сумма {algorithm} не совпадает")
+
+        os.replace(part, local_path)
+        _part_meta_path(part).unlink(missing_ok=True)
+        if offset:
+            logger.info(f"Загрузка {source_url} продолжена с {offset} байт")
+        record = AssetRecord(
+            url=source_url,
+            etag=response.headers.get('ETag'),
+            last_modified=response.headers.get('Last-Modified'),
+            size=size,
+            sha256=hashers['sha256'].hexdigest()
+        )
+        return record, received
+
+    @staticmethod
+    def _resume_point(source_url: str, part: Path) -> Tuple[int, Optional[str]]:
+        """Размер .part файла и валидатор, если загрузку можно продолжить"""
+        try:
+            meta = json.loads(_part_meta_path(part).read_text())
+            offset = part.stat().st_size
+        except (OSError, ValueError):
+            return 0, None
+        if meta.get('url') != source_url or not meta.get('validator') or not offset:
+            return 0, None
+        return offset, meta['validator']
+
+    @staticmethod
+    def _discard_part(part: Path) -> None:
+        """Удаление .part файла, который нельзя продолжить"""
+        part.unlink(missing_ok=True)
+        _part_meta_path(part).unlink(missing_ok=True)
+
+    async def close(self) -> None:
+        """Закрытие пула соединений"""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
@@ -0,0 +1,198 @@
+import asyncio
+import hashlib
+import logging
+import os
+import shutil
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, Optional, Set, Tuple
+
+from internal.config import TildaConfig
+from internal.manifest import AssetRecord
+from internal.metrics import IMAGE_OPTIMIZATIONS
+from internal.storage import temp_path
+
+try:
+    from PIL import Image, ImageOps, features
+except ImportError:
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+# Форматы исходников, которые обрабатывает оптимизатор
+OPTIMIZABLE_SUFFIXES = ('.png', '.jpg', '.jpeg')
+
+
+def _lossy_source(image: 'Image.Image') -> 'Image.Image':
+    """Изображение в режиме, который поддерживают WebP/AVIF и JPEG"""
+    if image.mode in ('RGB', 'RGBA'):
+        return image
+    return image.convert('RGBA' if image.has_transparency_data else 'RGB')
+
+
+def process_image(
+    source: Path, entry: Path, formats: Tuple[str, ...], widths: Tuple[int, ...], quality: int
+) -> None:
+    """Оптимизация изображения в каталог кэша entry (выполняется в процессе пула).
+
+    Имена файлов кэша: '_' - пережатый без потерь оригинал, '_.webp' - вариант в другом формате,
+    '_-640w' и '_-640w.webp' - уменьшенные копии.
+    """
+    entry.parent.mkdir(parents=True, exist_ok=True)
+    work = Path(tempfile.mkdtemp(prefix=f'.{entry.name}.', dir=entry.parent))
+    try:
+        with Image.open(source) as image:
+            image.load()
+            source_format = image.format
+            if not getattr(image, 'is_animated', False):
+                if source_format == 'PNG':
+                    image.save(work / '_', 'PNG', optimize=True)
+                    if (work / '_').stat().st_size >= source.stat().st_size:
+                        (work / '_').unlink()
+
+                image = ImageOps.exif_transpose(image)
+                versions = [('_', image)]
+                for width in widths:
+                    if width >= image.width:
+                        continue
+                    height = max(1, round(image.height * width / image.width))
+                    resized = _lossy_source(image).resize((width, height), Image.LANCZOS)
+                    name = f'_-{width}w'
+                    if source_format == 'PNG':
+                        resized.save(work / name, 'PNG', optimize=True)
+                    else:
+                        resized.convert('RGB').save(work / name, 'JPEG', quality=quality, optimize=True)
+                    versions.append((name, resized))
+                for name, version in versions:
+                    for fmt in formats:
+                        _lossy_source(version).save(work / f'{name}.{fmt}', fmt.upper(), quality=quality)
+        try:
+            os.rename(work, entry)
+        except OSError:
+            # Тот же исходник уже обработан параллельно
+            if not entry.exists():
+                raise
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+
+
+def _install(source: Path, target: Path) -> bool:
+    """Атомарная установка файла из кэша (жесткой ссылкой, если возможно). Возвращает признак замены"""
+    try:
+        if target.samefile(source):
+            return False
+    except FileNotFoundError:
+        pass
+    tmp = temp_path(target)
+    tmp.unlink(missing_ok=True)
+    try:
+        os.link(source, tmp)
+    except OSError:
+        shutil.copyfile(source, tmp)
+    os.replace(tmp, target)
+    return True
+
+
+class ImageOptimizer:
+    """Фоновая оптимизация изображений: пережатие без потерь, WebP/AVIF и уменьшенные копии.
+
+    Результаты хранятся в кэше по хешу исходника, поэтому неизменившиеся изображения
+    не обрабатываются повторно.
+    """
+
+    # Пул процессов общий для всех проектов
+    _executor: Optional[ProcessPoolExecutor] = None
+
+    def __init__(self, config: TildaConfig):
+        self.config = config
+        self.cache_path = config.state_path / 'images'
+        self.enabled = config.image_optimize
+        if self.enabled and Image is None:
+            logger.warning("Пакет Pillow не установлен, оптимизация изображений отключена")
+            self.enabled = False
+
+        self.formats: Tuple[str, ...] = ()
+        if self.enabled:
+            formats = []
+            for fmt in config.image_formats:
+                if features.check(fmt):
+                    formats.append(fmt)
+                else:
+                    logger.warning(f"Pillow собран без поддержки {fmt}, такие варианты создаваться не будут")
+            self.formats = tuple(formats)
+        self._settings = repr((self.formats, tuple(config.image_widths), config.image_quality))
+
+    @property
+    def executor(self) -> ProcessPoolExecutor:
+        """Пул процессов (создается при первом обращении)"""
+        if ImageOptimizer._executor is None:
+            ImageOptimizer._executor = ProcessPoolExecutor(max_workers=self.config.image_workers)
+        return ImageOptimizer._executor
+
+    def accepts(self, path: Path) -> bool:
+        """Обрабатывается ли файл оптимизатором"""
+        return self.enabled and path.suffix.lower() in OPTIMIZABLE_SUFFIXES
+
+    def cache_key(self, sha256: str) -> str:
+        """Ключ результата: хеш исходника и настройки оптимизации"""
+        return f"{sha256}-{hashlib.sha256(self._settings.encode()).hexdigest()[:8]}"
+
+    def is_installed(self, target: Path, record: AssetRecord) -> bool:
+        """Установлен ли для файла результат с текущими настройками"""
+        return (
+            record.optimized == self.cache_key(record.sha256)
+            and all((target.parent / name).exists() for name in record.variants)
+        )
+
+    async def optimize(self, target: Path, sha256: str) -> Dict[str, bool]:
+        """Оптимизация файла target с исходным хешем sha256.
+
+        Возвращает имена установленных рядом с target файлов и признак их замены.
+        """
+        key = self.cache_key(sha256)
+        entry = self.cache_path / key[:2] / key
+        if entry.exists():
+            IMAGE_OPTIMIZATIONS.labels('cached').inc()
+        else:
+            try:
+                await asyncio.get_running_loop().run_in_executor(
+                    self.executor, process_image, target, entry,
+                    self.formats, tuple(self.config.image_widths), self.config.image_quality
+                )
+            except Exception:
+                IMAGE_OPTIMIZATIONS.labels('failed').inc()
+                raise
+            IMAGE_OPTIMIZATIONS.labels('processed').inc()
+
+        installed = {}
+        for cached in sorted(entry.iterdir()):
+            tag, _, fmt = cached.name[1:].partition('.')
+            name = f'{target.stem}{tag}{target.suffix}' + (f'.{fmt}' if fmt else '')
+            installed[name] = _install(cached, target.with_name(name))
+        return installed
+
+    def forget(self, sha256: str) -> None:
+        """Удаление результата из кэша (установленные копии - жесткие ссылки на него и могли быть повреждены вместе)"""
+        key = self.cache_key(sha256)
+        shutil.rmtree(self.cache_path / key[:2] / key, ignore_errors=True)
+
+    def prune(self, keep: Set[str], older_than: float) -> None:
+        """Удаление из кэша результатов, которые не установлены ни для одного файла"""
+        if not self.cache_path.exists():
+            return
+        now = time.time()
+        for shard in self.cache_path.iterdir():
+            for entry in shard.iterdir():
+                # Каталоги с точкой - незавершенная обработка
+                if entry.name in keep or entry.name.startswith('.'):
+                    continue
+                if now - entry.stat().st_mtime >= older_than:
+                    shutil.rmtree(entry, ignore_errors=True)
+
+    def close(self) -> None:
+        """Остановка пула процессов"""
+        if ImageOptimizer._executor is not None:
+            ImageOptimizer._executor.shutdown(cancel_futures=True)
+            ImageOptimizer._executor = None
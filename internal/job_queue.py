@@ -0,0 +1,191 @@
+import json
+import logging
+import sqlite3
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from internal.config import TildaConfig
+from internal.scheduler import ExportJob
+
+logger = logging.getLogger(__name__)
+
+# Ключ чекпоинта с файлами уровня проекта (id страниц Tilda не бывают пустыми)
+PROJECT_KEY = ''
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    project_id TEXT NOT NULL,
+    status TEXT NOT NULL,
+    job TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    root TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status);
+CREATE TABLE IF NOT EXISTS checkpoints (
+    job_id INTEGER NOT NULL REFERENCES jobs (id) ON DELETE CASCADE,
+    page_id TEXT NOT NULL,
+    data TEXT NOT NULL,
+    PRIMARY KEY (job_id, page_id)
+);
+"""
+
+
+class JobQueue:
+    """Журнал заданий экспорта в SQLite.
+
+    Задание записывается при приеме вебхука и помечается выполненным только после
+    экспорта, поэтому после перезапуска или падения процесса незавершенные задания
+    восстанавливаются. Статусы: pending, running, done, partial (часть страниц или
+    файлов не экспортирована), failed, merged.
+    """
+
+    def __init__(self, config: TildaConfig):
+        self.config = config
+        config.queue_path.parent.mkdir(parents=True, exist_ok=True)
+        # Обращения идут из event loop, но TestClient и uvicorn могут создать его в другом потоке
+        self._db = sqlite3.connect(config.queue_path, isolation_level=None, check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        # WAL требует общей памяти процессов, поэтому на сетевой файловой системе используется обычный журнал
+        self._db.execute(f"PRAGMA journal_mode={'DELETE' if config.queue_shared else 'WAL'}")
+        self._db.execute('PRAGMA foreign_keys=ON')
+        # Журнал общий для всех процессов сервиса: ждем, пока другой процесс завершит запись
+        self._db.execute('PRAGMA busy_timeout=5000')
+        self._db.executescript(SCHEMA)
+
+    def save(self, job: ExportJob) -> None:
+        """Запись ожидающего задания (новое задание получает id)"""
+        payload = job.model_dump_json(exclude={'id'})
+        now = time.time()
+        if job.id is None:
+            cursor = self._db.execute(
+                "INSERT INTO jobs (project_id, status, job, created_at, updated_at) VALUES (?, 'pending', ?, ?, ?)",
+                (job.project_id, payload, now, now)
+            )
+            job.id = cursor.lastrowid
+        else:
+            self._db.execute("UPDATE jobs SET job = ?, updated_at = ? WHERE id = ?", (payload, now, job.id))
+
+    def start(self, job: ExportJob) -> None:
+        """Отметка о начале выполнения"""
+        self._db.execute(
+            "UPDATE jobs SET status = 'running', attempts = attempts + 1, started_at = ? WHERE id = ?",
+            (time.time(), job.id)
+        )
+
+    def retry(self, job: ExportJob, error: str) -> None:
+        """Возврат задания в ожидание после временной ошибки (чекпоинты сохраняются)"""
+        self._db.execute(
+            "UPDATE jobs SET status = 'pending', job = ?, error = ?, updated_at = ? WHERE id = ?",
+            (job.model_dump_json(exclude={'id'}), error, time.time(), job.id)
+        )
+
+    def finish(self, job: ExportJob, status: str, error: Optional[str] = None) -> None:
+        """Завершение задания: чекпоинты больше не нужны, старая история удаляется"""
+        self._db.execute(
+            "UPDATE jobs SET status = ?, error = ?, finished_at = ? WHERE id = ?",
+            (status, error, time.time(), job.id)
+        )
+        self._db.execute("DELETE FROM checkpoints WHERE job_id = ?", (job.id,))
+        self._db.execute(
+            "DELETE FROM jobs WHERE status NOT IN ('pending', 'running') AND id NOT IN ("
+            "SELECT id FROM jobs WHERE status NOT IN ('pending', 'running') ORDER BY id DESC LIMIT ?)",
+            (self.config.queue_history,)
+        )
+
+    def unfinished(self, project_id: Optional[str] = None) -> List[ExportJob]:
+        """Незавершенные задания (в порядке поступления): оставшиеся после остановки
+        процесса или переданные другими процессами"""
+        query = "SELECT * FROM jobs WHERE status IN ('pending', 'running')"
+        params = []
+        if project_id is not None:
+            query += " AND project_id = ?"
+            params.append(project_id)
+        jobs = []
+        for row in self._db.execute(query + " ORDER BY id", params):
+            job = ExportJob.model_validate_json(row['job'])
+            job.id = row['id']
+            jobs.append(job)
+        return jobs
+
+    def checkpoint(self, job: ExportJob) -> 'JobCheckpoint':
+        """Чекпоинты страниц задания"""
+        return JobCheckpoint(self, job.id)
+
+    def list(self, status: Optional[str] = None, limit: int = 50) -> List[dict]:
+        """Задания для просмотра (новые первыми) с числом сохраненных чекпоинтов"""
+        query = (
+            "SELECT jobs.*, (SELECT COUNT(*) FROM checkpoints WHERE job_id = jobs.id AND page_id != '') AS pages_done "
+            "FROM jobs"
+        )
+        params: list = []
+        if status:
+            query += " WHERE status = ?"
+            params.append(status)
+        query += " ORDER BY id DESC LIMIT ?"
+        params.append(limit)
+
+        jobs = []
+        for row in self._db.execute(query, params):
+            item = dict(row)
+            item['job'] = json.loads(item['job'])
+            jobs.append(item)
+        return jobs
+
+    def close(self) -> None:
+        """Закрытие базы"""
+        self._db.close()
+
+
+class JobCheckpoint:
+    """Чекпоинты страниц задания: прерванный полный экспорт продолжается с места остановки.
+
+    Для каждой сохраненной страницы хранятся ее файл, published, ассеты с записями
+    манифеста и изменившиеся файлы (для коммита), а для задания - каталог версии.
+    """
+
+    def __init__(self, queue: JobQueue, job_id: int):
+        self._db = queue._db
+        self.job_id = job_id
+        row = self._db.execute("SELECT root FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        self.root: Optional[Path] = Path(row['root']) if row and row['root'] else None
+        self.pages: Dict[str, dict] = {
+            row['page_id']: json.loads(row['data'])
+            for row in self._db.execute("SELECT page_id, data FROM checkpoints WHERE job_id = ?", (job_id,))
+        }
+        self.project = self.pages.pop(PROJECT_KEY, {})
+
+    def set_root(self, root: Optional[Path]) -> None:
+        """Каталог версии, в который идет экспорт; при смене каталога чекпоинты сбрасываются"""
+        if root == self.root:
+            return
+        if self.pages or self.project:
+            logger.info("Каталог прерванной версии не найден, экспорт начинается заново")
+        self.root = root
+        self.pages, self.project = {}, {}
+        self._db.execute("DELETE FROM checkpoints WHERE job_id = ?", (self.job_id,))
+        self._db.execute(
+            "UPDATE jobs SET root = ? WHERE id = ?", (str(root) if root is not None else None, self.job_id)
+        )
+
+    def save_page(self, page_id: str, entry: dict) -> None:
+        """Сохранение экспортированной страницы"""
+        self.pages[page_id] = entry
+        self._write(page_id, entry)
+
+    def save_project(self, entry: dict) -> None:
+        """Сохранение результата обработки ассетов проекта"""
+        self.project = entry
+        self._write(PROJECT_KEY, entry)
+
+    def _write(self, key: str, entry: dict) -> None:
+        self._db.execute(
+            "INSERT OR REPLACE INTO checkpoints (job_id, page_id, data) VALUES (?, ?, ?)",
+            (self.job_id, key, json.dumps(entry, ensure_ascii=False))
+        )
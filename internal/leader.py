@@ -0,0 +1,59 @@
+import fcntl
+import logging
+import os
+import socket
+from pathlib import Path
+from typing import IO, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class ExportLease:
+    """Право экспортировать проект среди процессов и реплик на общем томе.
+
+    Это POSIX-блокировка файла в каталоге состояния проекта: ее держит ведущий
+    процесс, пока он жив. При падении процесса блокировку снимает ОС (или NFS-сервер),
+    и проект подхватывает следующий процесс.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._file: Optional[IO[str]] = None
+
+    @property
+    def held(self) -> bool:
+        return self._file is not None
+
+    def try_acquire(self) -> bool:
+        """Попытка стать ведущим без ожидания"""
+        if self._file is not None:
+            return True
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        # Дескриптор открывается один раз: закрытие любого дескриптора файла снимает POSIX-блокировку
+        file = open(self.path, 'a+')
+        try:
+            fcntl.lockf(file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            file.close()
+            return False
+        file.seek(0)
+        file.truncate()
+        file.write(f"{socket.gethostname()} {os.getpid()}\n")
+        file.flush()
+        self._file = file
+        return True
+
+    def owner(self) -> Optional[str]:
+        """Процесс, который держит блокировку (хост и pid)"""
+        if self._file is not None:
+            return f"{socket.gethostname()} {os.getpid()}"
+        try:
+            return self.path.read_text().strip() or None
+        except FileNotFoundError:
+            return None
+
+    def release(self) -> None:
+        """Освобождение блокировки"""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
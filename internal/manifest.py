@@ -0,0 +1,134 @@
+import json
+import logging
+from pathlib import Path
+from typing import Dict, List, Optional, Set
+
+from pydantic import BaseModel, Field
+
+from internal.storage import atomic_write_text
+
+logger = logging.getLogger(__name__)
+
+
+class AssetRecord(BaseModel):
+    """Сведения о загруженном ассете"""
+    url: str
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+    size: int
+    sha256: str
+    # Размер файла на диске, если оптимизатор изображений заменил его пережатой копией
+    stored_size: Optional[int] = None
+    # Ключ результата оптимизатора изображений, установленного для этой версии файла
+    optimized: Optional[str] = None
+    # Производные файлы в том же каталоге (WebP/AVIF, уменьшенные копии)
+    variants: List[str] = Field(default_factory=list)
+
+
+class FileRecord(BaseModel):
+    """Контрольная сумма файла, созданного экспортером (HTML, сжатая копия, результат оптимизатора)"""
+    size: int
+    sha256: str
+    # Файл, из которого получен этот (None - HTML страницы)
+    source: Optional[str] = None
+
+
+class ExportManifest:
+    """Состояние последнего экспорта проекта"""
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.pages: Dict[str, dict] = {}
+        self.assets: Dict[str, AssetRecord] = {}
+        # Ассеты уровня проекта (None - еще не индексировались)
+        self.project_assets: Optional[List[str]] = None
+        # Файлы, на которые больше ничего не ссылается: путь -> время обнаружения
+        self.orphans: Dict[str, float] = {}
+        # Созданные экспортером файлы: путь -> размер и SHA-256 (для проверки экспорта)
+        self.files: Dict[str, FileRecord] = {}
+        self.load()
+
+    def load(self) -> None:
+        """Загрузка манифеста с диска"""
+        if not self.path.exists():
+            return
+        try:
+            self.from_dict(json.loads(self.path.read_text(encoding='utf-8')))
+        except (OSError, ValueError) as e:
+            logger.warning(f"Не удалось прочитать манифест {self.path}: {e}")
+            self.from_dict({})
+
+    def save(self) -> None:
+        """Сохранение манифеста через временный файл"""
+        atomic_write_text(self.path, json.dumps(self.to_dict(), ensure_ascii=False, indent=2))
+
+    def to_dict(self) -> dict:
+        """Сериализация манифеста"""
+        return {
+            'pages': self.pages,
+            'project_assets': self.project_assets,
+            'assets': {path: record.model_dump() for path, record in self.assets.items()},
+            'files': {path: record.model_dump() for path, record in self.files.items()},
+            'orphans': self.orphans
+        }
+
+    def from_dict(self, data: dict) -> None:
+        """Замена состояния манифеста данными из словаря"""
+        self.pages = data.get('pages', {})
+        self.project_assets = data.get('project_assets')
+        self.orphans = data.get('orphans', {})
+        self.assets = {
+            path: AssetRecord.model_validate(record)
+            for path, record in data.get('assets', {}).items()
+        }
+        self.files = {
+            path: FileRecord.model_validate(record)
+            for path, record in data.get('files', {}).items()
+        }
+
+    def get_page(self, page_id: str) -> Optional[dict]:
+        """Запись о странице из последнего экспорта"""
+        return self.pages.get(str(page_id))
+
+    def set_page(
+        self, page_id: str, filename: str, published: Optional[str], assets: Optional[List[str]] = None
+    ) -> None:
+        """Обновление записи о странице и списка ее ассетов"""
+        self.pages[str(page_id)] = {
+            'filename': filename,
+            'published': str(published) if published is not None else None,
+            'assets': sorted(assets) if assets is not None else None
+        }
+
+    def replace_pages(self, pages: Dict[str, dict]) -> None:
+        """Полная замена списка страниц после полного экспорта"""
+        self.pages = dict(pages)
+
+    def referenced_assets(self) -> Optional[Set[str]]:
+        """Ассеты, на которые ссылаются страницы и проект (None, если индекс неполный)"""
+        if self.project_assets is None:
+            return None
+        referenced = set(self.project_assets)
+        for page in self.pages.values():
+            if page.get('assets') is None:
+                return None
+            referenced.update(page['assets'])
+        return referenced
+
+    def get_asset(self, local_path: Path) -> Optional[AssetRecord]:
+        """Запись об ассете по локальному пути"""
+        return self.assets.get(str(local_path))
+
+    def set_asset(self, local_path: Path, record: AssetRecord) -> None:
+        """Обновление записи об ассете"""
+        self.assets[str(local_path)] = record
+
+    def set_file(self, local_path: Path, size: int, sha256: str, source: Optional[Path] = None) -> None:
+        """Запись контрольной суммы созданного экспортером файла"""
+        self.files[str(local_path)] = FileRecord(
+            size=size, sha256=sha256, source=str(source) if source is not None else None
+        )
+
+    def drop_file(self, local_path: Path) -> None:
+        """Удаление записи о файле, которого больше нет или который заменен загрузкой"""
+        self.files.pop(str(local_path), None)
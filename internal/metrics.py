@@ -0,0 +1,63 @@
+import json
+import logging
+from pathlib import Path
+from typing import Optional
+
+from prometheus_client import Counter, Gauge, Histogram
+
+logger = logging.getLogger(__name__)
+# Отдельный логгер для JSON-записей о длительности экспорта
+timing_logger = logging.getLogger('tilda_exporter.timing')
+
+EXPORTS = Counter(
+    'tilda_exports_total', 'Завершенные экспорты', ['kind', 'status']
+)
+EXPORT_DURATION = Histogram(
+    'tilda_export_duration_seconds', 'Длительность экспорта', ['kind'],
+    buckets=(1, 5, 10, 30, 60, 120, 300, 600, 1200, 1800)
+)
+EXPORT_PHASE = Histogram(
+    'tilda_export_phase_seconds',
+    'Суммарное время операций фазы экспорта (фазы выполняются параллельно)', ['phase'],
+    buckets=(0.1, 0.5, 1, 5, 10, 30, 60, 120, 300, 600, 1800)
+)
+DOWNLOADED_BYTES = Counter('tilda_downloaded_bytes_total', 'Получено байт ассетов')
+DOWNLOADED_FILES = Counter('tilda_downloaded_files_total', 'Загружено файлов ассетов')
+ASSET_CACHE = Counter(
+    'tilda_asset_cache_total', 'Проверки кэша ассетов (hit - ответ 304)', ['result']
+)
+API_CACHE = Counter(
+    'tilda_api_cache_total', 'Обращения к кэшу метаданных Tilda API', ['result']
+)
+API_LATENCY = Histogram(
+    'tilda_api_request_seconds', 'Длительность запроса к Tilda API', ['method'],
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+)
+API_RETRIES = Counter('tilda_api_retries_total', 'Повторные запросы к Tilda API', ['method'])
+IMAGE_OPTIMIZATIONS = Counter(
+    'tilda_image_optimizations_total',
+    'Оптимизация изображений (cached - результат взят из кэша по хешу исходника)', ['result']
+)
+STATIC_CACHE = Counter(
+    'tilda_static_cache_total', 'Обращения к кэшу встроенной раздачи файлов', ['result']
+)
+STATIC_CACHE_BYTES = Gauge('tilda_static_cache_bytes', 'Объем файлов в кэше встроенной раздачи')
+QUEUE_DEPTH = Gauge('tilda_export_queue_depth', 'Заданий экспорта в очереди')
+
+
+def record_export(record: dict, timing_log_path: Optional[Path] = None) -> None:
+    """Учет завершенного экспорта в метриках и запись JSON с его таймингами"""
+    EXPORTS.labels(record['kind'], record['status']).inc()
+    EXPORT_DURATION.labels(record['kind']).observe(record['duration'])
+    for phase, seconds in record['phases'].items():
+        EXPORT_PHASE.labels(phase).observe(seconds)
+
+    line = json.dumps(record, ensure_ascii=False)
+    timing_logger.info(line)
+    if timing_log_path is not None:
+        try:
+            timing_log_path.parent.mkdir(parents=True, exist_ok=True)
+            with open(timing_log_path, 'a', encoding='utf-8') as f:
+                f.write(line + '\n')
+        except OSError as e:
+            logger.warning(f"Не удалось записать тайминги в {timing_log_path}: {e}")
@@ -0,0 +1,262 @@
+import asyncio
+import logging
+import time
+from datetime import datetime
+from typing import TYPE_CHECKING, Awaitable, Callable, Dict, Optional
+
+import httpx
+from pydantic import BaseModel, Field
+
+from internal.config import TildaConfig
+from internal.tilda_api import TildaApiUnavailable
+
+if TYPE_CHECKING:
+    from internal.job_queue import JobQueue
+
+logger = logging.getLogger(__name__)
+
+# Временные ошибки: задание остается в очереди и повторяется позже
+TRANSIENT_ERRORS = (TildaApiUnavailable, httpx.TransportError)
+
+
+class ExportJob(BaseModel):
+    """Задание на экспорт проекта, собранное из одного или нескольких вебхуков"""
+    # Номер задания в журнале (None, если журнал не используется)
+    id: Optional[int] = None
+    project_id: str
+    # id страницы -> значение published из вебхука
+    pages: Dict[str, Optional[str]] = Field(default_factory=dict)
+    full: bool = False
+    # Сверить все страницы с опубликованными в Tilda и обновить устаревшие
+    sync: bool = False
+    created_at: float = Field(default_factory=time.time)
+    updated_at: float = Field(default_factory=time.time)
+    # Повторы после временных ошибок и время, раньше которого задание не запускается
+    retries: int = 0
+    retry_at: Optional[float] = None
+
+
+class ExportScheduler:
+    """Планировщик экспортов.
+
+    Склеивает всплески вебхуков в одно задание на проект. У каждого проекта своя
+    очередь и свой обработчик: проект экспортируется не более чем одним заданием
+    одновременно, а всего одновременно выполняется не больше TILDA_PROJECT_CONCURRENCY
+    экспортов. С журналом (JobQueue) задания сохраняются на диск и восстанавливаются
+    после перезапуска.
+    """
+
+    def __init__(
+        self, config: TildaConfig, handler: Callable[[ExportJob], Awaitable[Optional[dict]]],
+        queue: Optional['JobQueue'] = None
+    ):
+        self.config = config
+        self.handler = handler
+        self.queue = queue
+        self._pending: Dict[str, ExportJob] = {}
+        self._wake: Dict[str, asyncio.Event] = {}
+        self._workers: Dict[str, asyncio.Task] = {}
+        self._slots = asyncio.Semaphore(config.project_concurrency)
+        self._started = False
+        # Выполняющиеся задания и результаты последних запусков по проектам
+        self.running: Dict[str, ExportJob] = {}
+        self.last_run: Dict[str, dict] = {}
+
+    def submit(
+        self, project_id: str, page_id: Optional[str] = None, published: Optional[str] = None,
+        sync: bool = False
+    ) -> None:
+        """Добавление вебхука в очередь (с объединением с уже ожидающим заданием).
+
+        Без page_id ставится полный экспорт, с sync=True - сверка страниц с Tilda.
+        """
+        job = self._pending.get(project_id)
+        if job is None:
+            job = self._pending[project_id] = ExportJob(project_id=project_id)
+        job.updated_at = time.time()
+
+        if sync:
+            job.sync = True
+        elif page_id is None:
+            job.full = True
+        else:
+            job.pages[page_id] = published
+        if len(job.pages) > self.config.incremental_page_limit:
+            job.full = True
+        if self.queue is not None:
+            self.queue.save(job)
+
+        self._wake.setdefault(project_id, asyncio.Event()).set()
+        if self._started:
+            self._ensure_worker(project_id)
+
+    def forward(self, project_id: str, page_id: Optional[str] = None, published: Optional[str] = None) -> bool:
+        """Передача вебхука процессу, который экспортирует проект, через общий журнал.
+
+        Без журнала передать задание некому, и вебхук отбрасывается (возвращается False).
+        """
+        if self.queue is None:
+            return False
+        job = ExportJob(project_id=project_id)
+        if page_id is None:
+            job.full = True
+        else:
+            job.pages[page_id] = published
+        self.queue.save(job)
+        return True
+
+    def restore(self, project_id: Optional[str] = None) -> int:
+        """Прием незавершенных заданий из журнала: оставшихся после перезапуска
+        или переданных другими процессами.
+
+        Задания одного проекта объединяются в самое раннее: у прерванного задания
+        есть чекпоинты, и экспорт продолжится с них. Возвращает число принятых заданий.
+        """
+        if self.queue is None:
+            return 0
+        known = {job.id for job in [*self._pending.values(), *self.running.values()]}
+        jobs = [job for job in self.queue.unfinished(project_id) if job.id not in known]
+        for job in jobs:
+            pending = self._pending.get(job.project_id)
+            if pending is None:
+                self._pending[job.project_id] = job
+            else:
+                pending.pages.update(job.pages)
+                pending.full = pending.full or job.full or len(pending.pages) > self.config.incremental_page_limit
+                pending.sync = pending.sync or job.sync
+                pending.updated_at = max(pending.updated_at, job.updated_at)
+                self.queue.save(pending)
+                self.queue.finish(job, 'merged')
+            self._wake.setdefault(job.project_id, asyncio.Event()).set()
+            if self._started:
+                self._ensure_worker(job.project_id)
+        if jobs:
+            logger.info(f"Принято заданий из журнала: {len(jobs)}")
+        return len(jobs)
+
+    @property
+    def queue_depth(self) -> int:
+        """Число заданий, ожидающих запуска"""
+        return len(self._pending)
+
+    def status(self) -> dict:
+        """Состояние очереди для мониторинга"""
+        return {
+            'queue_depth': self.queue_depth,
+            'pending': [job.model_dump() for job in self._pending.values()],
+            'running': [job.model_dump() for job in self.running.values()],
+            'last_run': self.last_run
+        }
+
+    def start(self) -> None:
+        """Запуск фоновых обработчиков очередей"""
+        self._started = True
+        for project_id in self._pending:
+            self._ensure_worker(project_id)
+
+    async def stop(self) -> None:
+        """Остановка обработчиков (текущие экспорты прерываются)"""
+        self._started = False
+        workers = list(self._workers.values())
+        self._workers.clear()
+        for worker in workers:
+            worker.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+
+    def _ensure_worker(self, project_id: str) -> None:
+        """Запуск обработчика очереди проекта, если его еще нет"""
+        if project_id not in self._workers:
+            self._workers[project_id] = asyncio.create_task(self._run(project_id))
+
+    def _ready_at(self, job: ExportJob) -> float:
+        """Момент запуска задания: пауза во всплеске вебхуков, но не позже max_delay
+        (и не раньше повтора после временной ошибки)"""
+        ready = min(
+            job.updated_at + self.config.webhook_debounce,
+            job.created_at + self.config.webhook_max_delay
+        )
+        return max(ready, job.retry_at or 0)
+
+    async def _run(self, project_id: str) -> None:
+        """Цикл обработки проекта: ждет окончания окна склейки и выполняет задания по одному"""
+        wake = self._wake[project_id]
+        while True:
+            await wake.wait()
+            job = self._pending.get(project_id)
+            if job is None:
+                wake.clear()
+                continue
+
+            delay = self._ready_at(job) - time.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+                continue
+
+            async with self._slots:
+                # Вебхуки, пришедшие во время ожидания слота, уже склеены с этим заданием
+                job = self._pending.pop(project_id)
+                if self.queue is not None:
+                    self.queue.start(job)
+                await self._execute(job)
+
+    async def _execute(self, job: ExportJob) -> None:
+        """Выполнение задания с записью результата"""
+        self.running[job.project_id] = job
+        started = time.time()
+        status = {
+            'project_id': job.project_id,
+            'pages': sorted(job.pages),
+            'full': job.full,
+            'sync': job.sync,
+            'started_at': datetime.fromtimestamp(started).isoformat(timespec='seconds')
+        }
+        try:
+            # Обработчик возвращает страницы и файлы, которые не удалось экспортировать
+            failures = await self.handler(job)
+            status['status'] = 'partial' if failures else 'ok'
+            if failures:
+                status['failed'] = failures
+                status['error'] = (
+                    f"не экспортировано страниц: {len(failures['pages'])}, файлов: {len(failures['assets'])}"
+                )
+        except TRANSIENT_ERRORS as e:
+            status['status'] = 'retry'
+            status['error'] = str(e)
+            self._retry(job, str(e))
+        except Exception as e:
+            logger.error(f"Ошибка выполнения экспорта проекта {job.project_id}: {e}")
+            status['status'] = 'error'
+            status['error'] = str(e)
+        finally:
+            # При остановке сервера (отмене) задание остается в журнале и продолжится после запуска
+            if self.queue is not None and status.get('status') in ('ok', 'partial', 'error'):
+                outcome = {'ok': 'done', 'partial': 'partial', 'error': 'failed'}[status['status']]
+                self.queue.finish(job, outcome, status.get('error'))
+            status['duration'] = round(time.time() - started, 3)
+            self.last_run[job.project_id] = status
+            del self.running[job.project_id]
+
+    def _retry(self, job: ExportJob, error: str) -> None:
+        """Возврат задания в очередь после временной ошибки с экспоненциальной задержкой.
+
+        Вебхуки, пришедшие за время выполнения, объединяются с ним: у задания могут
+        быть чекпоинты, и экспорт продолжится с них.
+        """
+        delay = min(self.config.job_retry_delay * 2 ** job.retries, self.config.job_retry_max_delay)
+        job.retries += 1
+        job.retry_at = time.time() + delay
+        logger.warning(
+            f"Экспорт проекта {job.project_id} не удался ({error}), повтор через {delay:.1f} с"
+        )
+        newer = self._pending.get(job.project_id)
+        if newer is not None:
+            job.pages.update(newer.pages)
+            job.full = job.full or newer.full or len(job.pages) > self.config.incremental_page_limit
+            job.sync = job.sync or newer.sync
+            job.updated_at = max(job.updated_at, newer.updated_at)
+            if self.queue is not None and newer.id is not None:
+                self.queue.finish(newer, 'merged')
+        self._pending[job.project_id] = job
+        if self.queue is not None:
+            self.queue.retry(job, error)
+        self._wake.setdefault(job.project_id, asyncio.Event()).set()
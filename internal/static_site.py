@@ -0,0 +1,212 @@
+import asyncio
+import logging
+import os
+import stat
+from collections import OrderedDict
+from email.utils import formatdate
+from mimetypes import guess_type
+from pathlib import Path, PurePosixPath
+from typing import List, Optional, Tuple
+
+from fastapi import Request
+from fastapi.responses import FileResponse, PlainTextResponse, Response
+
+from internal.compressor import COMPRESSIBLE_SUFFIXES
+from internal.config import TildaConfig
+from internal.metrics import STATIC_CACHE
+from internal.storage import SnapshotStorage
+
+logger = logging.getLogger(__name__)
+
+# Кодировки сжатых копий в порядке предпочтения
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+
+class StaticFile:
+    """Файл, найденный на диске (содержимое хранится только у небольших файлов)"""
+
+    def __init__(self, path: Path, stat_result: os.stat_result, data: Optional[bytes] = None):
+        self.path = path
+        self.stat_result = stat_result
+        self.data = data
+        # Файлы заменяются только через rename, поэтому inode+mtime+size однозначно задают содержимое
+        self.etag = f'"{stat_result.st_ino:x}-{stat_result.st_mtime_ns:x}-{stat_result.st_size:x}"'
+
+    @property
+    def size(self) -> int:
+        return self.stat_result.st_size
+
+
+class StaticSite:
+    """Раздача экспорта: кэш небольших файлов в памяти (LRU), ETag/304, Range и сжатые копии"""
+
+    def __init__(self, config: TildaConfig, storage: SnapshotStorage):
+        self.config = config
+        if config.serve_root:
+            self.root = Path(config.serve_root)
+        else:
+            # Симлинк current разрешается при каждом открытии, поэтому переключение версии видно сразу
+            self.root = storage.current_link if storage.enabled else storage.base
+        # Путь -> файл (None - файла нет; кэшируется только для сжатых копий)
+        self._cache: 'OrderedDict[str, Optional[StaticFile]]' = OrderedDict()
+        self.cache_bytes = 0
+
+    def invalidate(self) -> None:
+        """Сброс кэша после экспорта"""
+        self._cache.clear()
+        self.cache_bytes = 0
+
+    async def serve(self, request: Request, url_path: str) -> Response:
+        """Ответ на GET/HEAD запрос файла сайта"""
+        relative = self._relative(url_path)
+        if relative is None:
+            return PlainTextResponse('Not Found', status_code=404)
+
+        for candidate in self._candidates(relative, url_path.endswith('/') or not url_path):
+            path = self.root / candidate
+            file = await self._lookup(path, cache_missing=False)
+            if file is not None:
+                break
+        else:
+            return PlainTextResponse('Not Found', status_code=404)
+
+        headers = {
+            'Last-Modified': formatdate(file.stat_result.st_mtime, usegmt=True),
+            'Cache-Control': 'no-cache' if path.suffix in ('.html', '.htm')
+            else f'public, max-age={self.config.serve_max_age}',
+            'Accept-Ranges': 'bytes'
+        }
+        # Диапазоны отдаются только из несжатого файла
+        if path.suffix.lower() in COMPRESSIBLE_SUFFIXES:
+            headers['Vary'] = 'Accept-Encoding'
+            if 'range' not in request.headers:
+                accepted = self._accepted_encodings(request)
+                for encoding, suffix in ENCODINGS:
+                    if encoding not in accepted:
+                        continue
+                    variant = await self._lookup(path.with_name(path.name + suffix), cache_missing=True)
+                    if variant is not None:
+                        file = variant
+                        headers['Content-Encoding'] = encoding
+                        break
+        headers['ETag'] = file.etag
+
+        if self._not_modified(request, file.etag):
+            return Response(status_code=304, headers=headers)
+
+        media_type = guess_type(path.name)[0] or 'application/octet-stream'
+        if file.data is None:
+            # Большие файлы читаются с диска частями (Range и If-Range обрабатывает FileResponse)
+            return FileResponse(file.path, headers=headers, media_type=media_type, stat_result=file.stat_result)
+
+        byte_range = self._range(request, file)
+        if byte_range is None:
+            return Response(file.data, headers=headers, media_type=media_type)
+        if byte_range == (-1, -1):
+            return Response(status_code=416, headers={'Content-Range': f'bytes */{file.size}'})
+        start, end = byte_range
+        headers['Content-Range'] = f'bytes {start}-{end - 1}/{file.size}'
+        return Response(file.data[start:end], status_code=206, headers=headers, media_type=media_type)
+
+    @staticmethod
+    def _relative(url_path: str) -> Optional[PurePosixPath]:
+        """Относительный путь файла; скрытые файлы и выход за корень запрещены"""
+        parts = [part for part in url_path.split('/') if part]
+        if any(part.startswith('.') or '\\' in part or '\0' in part for part in parts):
+            return None
+        return PurePosixPath(*parts)
+
+    @staticmethod
+    def _candidates(relative: PurePosixPath, is_directory: bool) -> List[PurePosixPath]:
+        """Варианты файла для URL: сам файл, страница без .html и index.html каталога"""
+        if is_directory:
+            return [relative / 'index.html']
+        return [relative, relative.with_name(relative.name + '.html'), relative / 'index.html']
+
+    async def _lookup(self, path: Path, cache_missing: bool) -> Optional[StaticFile]:
+        """Файл из кэша или с диска"""
+        key = str(path)
+        if key in self._cache:
+            self._cache.move_to_end(key)
+            STATIC_CACHE.labels('hit').inc()
+            return self._cache[key]
+
+        STATIC_CACHE.labels('miss').inc()
+        try:
+            file = await asyncio.to_thread(self._read, path)
+        except (FileNotFoundError, NotADirectoryError, IsADirectoryError):
+            file = None
+        if file is None:
+            if cache_missing:
+                self._store(key, None)
+        elif file.data is not None:
+            self._store(key, file)
+        return file
+
+    def _read(self, path: Path) -> Optional[StaticFile]:
+        """Чтение файла: небольшие целиком, для больших только метаданные"""
+        with open(path, 'rb') as f:
+            stat_result = os.fstat(f.fileno())
+            if not stat.S_ISREG(stat_result.st_mode):
+                return None
+            data = f.read() if stat_result.st_size <= self.config.serve_cache_file_limit else None
+        return StaticFile(path, stat_result, data)
+
+    def _store(self, key: str, file: Optional[StaticFile]) -> None:
+        """Добавление в кэш с вытеснением давно не использовавшихся файлов"""
+        size = file.size if file is not None else 0
+        if size > self.config.serve_cache_size:
+            return
+        self._cache[key] = file
+        self.cache_bytes += size
+        while self.cache_bytes > self.config.serve_cache_size:
+            _, evicted = self._cache.popitem(last=False)
+            if evicted is not None:
+                self.cache_bytes -= evicted.size
+
+    @staticmethod
+    def _accepted_encodings(request: Request) -> List[str]:
+        """Кодировки из Accept-Encoding (без q=0)"""
+        accepted = []
+        for item in request.headers.get('accept-encoding', '').split(','):
+            name, _, params = item.strip().partition(';')
+            if name and params.replace(' ', '') not in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000'):
+                accepted.append(name.lower())
+        return accepted
+
+    @staticmethod
+    def _not_modified(request: Request, etag: str) -> bool:
+        """Совпадает ли If-None-Match с ETag"""
+        if_none_match = request.headers.get('if-none-match')
+        if if_none_match is None:
+            return False
+        tags = [tag.strip() for tag in if_none_match.split(',')]
+        return '*' in tags or etag in tags or f'W/{etag}' in tags
+
+    @staticmethod
+    def _range(request: Request, file: StaticFile) -> Optional[Tuple[int, int]]:
+        """Диапазон [start, end) из заголовка Range; (-1, -1) - диапазон вне файла.
+
+        Несколько диапазонов не поддерживаются: в этом случае отдается весь файл.
+        """
+        header = request.headers.get('range')
+        if header is None or not header.startswith('bytes=') or ',' in header:
+            return None
+        if_range = request.headers.get('if-range')
+        if if_range is not None and if_range != file.etag:
+            return None
+
+        start, _, end = header[len('bytes='):].strip().partition('-')
+        try:
+            if not start:
+                suffix = int(end)
+                if suffix == 0:
+                    return -1, -1
+                return max(file.size - suffix, 0), file.size
+            first = int(start)
+            last = min(int(end), file.size - 1) if end else file.size - 1
+        except ValueError:
+            return None
+        if first >= file.size or last < first:
+            return -1, -1
+        return first, last + 1
@@ -0,0 +1,194 @@
+import hashlib
+import json
+import logging
+import os
+import shutil
+from datetime import datetime
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+from internal.config import TildaConfig
+
+logger = logging.getLogger(__name__)
+
+
+def temp_path(path: Path) -> Path:
+    """Временный файл рядом с целевым (для записи с последующим переименованием)"""
+    return path.with_name(f'.{path.name}.tmp')
+
+
+def atomic_write_bytes(path: Path, data: bytes) -> None:
+    """Запись файла целиком: читатели видят либо старое, либо новое содержимое"""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = temp_path(path)
+    tmp.write_bytes(data)
+    os.replace(tmp, path)
+
+
+def atomic_write_text(path: Path, text: str) -> None:
+    """Атомарная запись текстового файла в UTF-8"""
+    atomic_write_bytes(path, text.encode('utf-8'))
+
+
+def write_if_changed(path: Path, data: bytes) -> bool:
+    """Атомарная запись, только если содержимое отличается. Возвращает признак изменения"""
+    try:
+        if path.read_bytes() == data:
+            return False
+    except FileNotFoundError:
+        pass
+    atomic_write_bytes(path, data)
+    return True
+
+
+def file_digest(path: Path) -> Tuple[int, str]:
+    """Размер и SHA-256 файла"""
+    with open(path, 'rb') as f:
+        digest = hashlib.file_digest(f, 'sha256')
+        return f.tell(), digest.hexdigest()
+
+
+def files_equal(first: Path, second: Path, chunk_size: int = 1024 * 1024) -> bool:
+    """Совпадает ли содержимое файлов (FileNotFoundError, если какого-то нет)"""
+    if first.stat().st_size != second.stat().st_size:
+        return False
+    with open(first, 'rb') as a, open(second, 'rb') as b:
+        while True:
+            chunk = a.read(chunk_size)
+            if chunk != b.read(chunk_size):
+                return False
+            if not chunk:
+                return True
+
+
+class SnapshotStorage:
+    """Версионированное хранилище экспорта.
+
+    При TILDA_SNAPSHOTS=true каждый полный экспорт собирается в
+    base_path/releases/<версия> и публикуется атомарной заменой симлинка
+    base_path/current. Без снапшотов файлы пишутся на месте.
+    """
+
+    def __init__(self, config: TildaConfig):
+        self.config = config
+        self.enabled = config.snapshots
+        self.base = Path(config.base_path)
+        self.releases_path = self.base / 'releases'
+        self.current_link = self.base / 'current'
+        self.manifests_path = config.state_path / 'releases'
+
+        if self.enabled:
+            for asset_type, path in config.paths.items():
+                if not path.is_relative_to(self.base):
+                    raise ValueError(
+                        f"Путь {asset_type} ({path}) должен лежать внутри {self.base} при TILDA_SNAPSHOTS=true"
+                    )
+
+    def live_root(self) -> Optional[Path]:
+        """Каталог опубликованной версии (None, если снапшоты выключены или еще не создавались)"""
+        if not self.enabled:
+            return None
+        if not self.current_link.exists():
+            return None
+        return self.current_link.resolve()
+
+    def has_live(self) -> bool:
+        """Есть ли опубликованный экспорт, который можно обновлять инкрементально"""
+        return not self.enabled or self.live_root() is not None
+
+    def resolve(self, path: Path, root: Optional[Path]) -> Path:
+        """Физический путь файла внутри версии root"""
+        if root is None:
+            return path
+        return root / path.relative_to(self.base)
+
+    def releases(self) -> List[str]:
+        """Список версий от старой к новой"""
+        if not self.releases_path.exists():
+            return []
+        return sorted(p.name for p in self.releases_path.iterdir() if p.is_dir())
+
+    def begin_full(self, resume: Optional[Path] = None) -> Optional[Path]:
+        """Создание каталога новой версии на основе текущей (жесткие ссылки, без копирования данных).
+
+        resume - каталог неопубликованной версии прерванного экспорта, который можно продолжить.
+        """
+        if not self.enabled:
+            return None
+        if resume is not None and resume.parent == self.releases_path and resume.is_dir() \
+                and resume != self.live_root():
+            logger.info(f"Продолжаем сборку версии {resume.name}")
+            return resume
+
+        version = datetime.now().strftime('%Y%m%d-%H%M%S-%f')
+        staging = self.releases_path / version
+        live = self.live_root()
+        if live is not None:
+            shutil.copytree(live, staging, copy_function=os.link)
+        else:
+            staging.mkdir(parents=True)
+        logger.info(f"Подготовлена версия {version}")
+        return staging
+
+    def publish(self, staging: Optional[Path], manifest_data: dict) -> None:
+        """Атомарное переключение current на новую версию"""
+        if staging is None:
+            return
+
+        self.save_release_manifest(staging, manifest_data)
+        self._switch(staging.name)
+        logger.info(f"Опубликована версия {staging.name}")
+        self._prune()
+
+    def save_release_manifest(self, root: Optional[Path], manifest_data: dict) -> None:
+        """Сохранение манифеста версии (нужен при откате на нее)"""
+        if root is None:
+            return
+        atomic_write_text(
+            self.manifests_path / f'{root.name}.json',
+            json.dumps(manifest_data, ensure_ascii=False)
+        )
+
+    def abort(self, staging: Optional[Path]) -> None:
+        """Удаление неопубликованной версии"""
+        if staging is not None:
+            shutil.rmtree(staging, ignore_errors=True)
+
+    def rollback(self, version: Optional[str] = None) -> Tuple[str, dict]:
+        """Переключение на указанную (или предыдущую) версию. Возвращает версию и ее манифест"""
+        if not self.enabled:
+            raise ValueError("Снапшоты выключены (TILDA_SNAPSHOTS=false)")
+
+        releases = self.releases()
+        live = self.live_root()
+        if version is None:
+            older = [r for r in releases if live is None or r < live.name]
+            if not older:
+                raise ValueError("Нет предыдущей версии для отката")
+            version = older[-1]
+        elif version not in releases:
+            raise ValueError(f"Версия {version} не найдена")
+
+        manifest_file = self.manifests_path / f'{version}.json'
+        manifest_data = json.loads(manifest_file.read_text(encoding='utf-8')) if manifest_file.exists() else {}
+        self._switch(version)
+        logger.info(f"Выполнен откат на версию {version}")
+        return version, manifest_data
+
+    def _switch(self, version: str) -> None:
+        """Замена симлинка current через временный симлинк и rename"""
+        tmp_link = temp_path(self.current_link)
+        if tmp_link.is_symlink():
+            tmp_link.unlink()
+        os.symlink(Path('releases') / version, tmp_link)
+        os.replace(tmp_link, self.current_link)
+
+    def _prune(self) -> None:
+        """Удаление старых версий сверх TILDA_SNAPSHOT_KEEP (текущая не удаляется)"""
+        live = self.live_root()
+        releases = self.releases()
+        for version in releases[:max(len(releases) - self.config.snapshot_keep, 0)]:
+            if live is not None and version == live.name:
+                continue
+            shutil.rmtree(self.releases_path / version, ignore_errors=True)
+            (self.manifests_path / f'{version}.json').unlink(missing_ok=True)
@@ -0,0 +1,245 @@
+import codecs
+import json
+import re
+from json.decoder import scanstring
+from typing import Any, List, Optional, Tuple
+
+# Типы ассетов в ответе getpagefullexport
+ASSET_TYPES = ('images', 'js', 'css')
+
+# Символы строки и целые escape-последовательности (без кавычки и оборванного escape)
+_STRING_BODY = re.compile(r'[^"\\]*(?:(?:\\["\\/bfnrt]|\\u[0-9a-fA-F]{4})[^"\\]*)*')
+_HIGH_SURROGATE = re.compile(r'\\u[dD][89abAB][0-9a-fA-F]{2}')
+# Число, true, false или null: до разделителя
+_LITERAL = re.compile(r'[^\s,:\]}"]+')
+_WHITESPACE = re.compile(r'[ \t\r\n]*')
+
+
+class _Frame:
+    """Открытый объект или массив"""
+    __slots__ = ('is_object', 'container', 'path', 'key', 'expect')
+
+    def __init__(self, is_object: bool, container: Any, path: Tuple):
+        self.is_object = is_object
+        # None - значения внутри не собираются (отдаются событиями)
+        self.container = container
+        self.path = path
+        self.key: Optional[str] = None
+        self.expect = 'key' if is_object else 'value'
+
+
+class PageExportParser:
+    """Инкрементальный разбор ответа getpagefullexport.
+
+    feed() принимает очередной кусок тела ответа и возвращает события:
+    ('html', текст) - следующий кусок строки result.html, ('asset', тип, описание) -
+    очередной элемент result.images/js/css, ('field', имя, значение) - остальные поля
+    result. HTML в памяти не собирается, а все остальное, что парсер держит или отдает
+    событиями (поля, описания ассетов, еще не разобранный текст), вместе ограничено
+    buffer_limit символами.
+    """
+
+    def __init__(self, buffer_limit: int):
+        self.buffer_limit = buffer_limit
+        # Корневой объект без result (status, message)
+        self.root: Any = None
+        self.done = False
+        self._decoder = codecs.getincrementaldecoder('utf-8')()
+        self._text = ''
+        self._pos = 0
+        self._stack: List[_Frame] = []
+        self._events: List[tuple] = []
+        # Части текущей строки (None - разбор не внутри строки)
+        self._string: Optional[List[str]] = None
+        self._string_is_key = False
+        self._streaming = False
+        self._streamed = False
+        # Размер всех значений ответа, кроме HTML (они остаются в памяти у парсера или вызывающего)
+        self._size = 0
+
+    def feed(self, data: bytes) -> List[tuple]:
+        """Разбор очередного куска ответа"""
+        self._text = self._text[self._pos:] + self._decoder.decode(data)
+        self._pos = 0
+        self._parse(final=False)
+        # Неразобранный остаток (например, число без конца) тоже занимает память
+        if len(self._text) - self._pos > self.buffer_limit:
+            raise ValueError(f"Незавершенное значение в ответе API больше {self.buffer_limit} символов")
+        return self._take_events()
+
+    def close(self) -> List[tuple]:
+        """Завершение разбора; ValueError, если ответ оборван или некорректен"""
+        self._text = self._text[self._pos:] + self._decoder.decode(b'', final=True)
+        self._pos = 0
+        self._parse(final=True)
+        if not self.done or self._text[self._pos:].strip():
+            raise ValueError("Ответ API оборван или содержит лишние данные")
+        return self._take_events()
+
+    def _take_events(self) -> List[tuple]:
+        if self._streaming and self._string:
+            self._events.append(('html', ''.join(self._string)))
+            self._string = []
+        events, self._events = self._events, []
+        return events
+
+    def _parse(self, final: bool) -> None:
+        text = self._text
+        while self._pos < len(text):
+            if self._string is not None:
+                if not self._parse_string(text):
+                    return
+                continue
+
+            self._pos = _WHITESPACE.match(text, self._pos).end()
+            if self._pos >= len(text):
+                return
+            if self.done:
+                raise ValueError("Лишние данные после ответа API")
+            char = text[self._pos]
+            frame = self._stack[-1] if self._stack else None
+            if char == '"':
+                self._pos += 1
+                self._start_string(is_key=frame is not None and frame.is_object and frame.expect == 'key')
+            elif char in '{[':
+                self._pos += 1
+                self._open(char == '{')
+            elif char in '}]':
+                self._pos += 1
+                self._close()
+            elif char == ':' and frame is not None:
+                self._pos += 1
+                frame.expect = 'value'
+            elif char == ',' and frame is not None:
+                self._pos += 1
+                frame.expect = 'key' if frame.is_object else 'value'
+            else:
+                match = _LITERAL.match(text, self._pos)
+                if match is not None and match.end() == len(text) and not final:
+                    # Значение может продолжиться в следующем куске
+                    return
+                try:
+                    value = json.loads(match.group()) if match is not None else None
+                except ValueError:
+                    match = None
+                if match is None or isinstance(value, (str, list, dict)):
+                    raise ValueError(f"Некорректный JSON в ответе API: {text[self._pos:self._pos + 20]!r}")
+                self._pos = match.end()
+                self._account(len(match.group()))
+                self._value(value)
+
+    def _child_path(self) -> Tuple:
+        """Путь значения, которое начинается в текущей позиции"""
+        if not self._stack:
+            return ()
+        frame = self._stack[-1]
+        return frame.path + ((frame.key,) if frame.is_object else (None,))
+
+    def _open(self, is_object: bool) -> None:
+        path = self._child_path()
+        # Объект result и списки ассетов не собираются: их содержимое отдается событиями
+        collected = path != ('result',) and not (len(path) == 2 and path[0] == 'result' and path[1] in ASSET_TYPES)
+        self._account(1)
+        self._stack.append(_Frame(is_object, ({} if is_object else []) if collected else None, path))
+
+    def _close(self) -> None:
+        if not self._stack:
+            raise ValueError("Некорректный JSON в ответе API: лишняя закрывающая скобка")
+        self._value(self._stack.pop().container)
+
+    def _value(self, value: Any) -> None:
+        """Значение завершено: добавляется в родителя или отдается событием"""
+        if not self._stack:
+            self.root = value
+            self.done = True
+            return
+        frame = self._stack[-1]
+        frame.expect = 'comma'
+        if frame.path == ('result',):
+            if self._streamed and frame.key == 'html':
+                self._streamed = False
+            elif frame.key not in ASSET_TYPES:
+                self._events.append(('field', frame.key, value))
+        elif len(frame.path) == 2 and frame.path[0] == 'result' and frame.path[1] in ASSET_TYPES:
+            if isinstance(value, dict):
+                self._events.append(('asset', frame.path[1], value))
+        elif frame.container is not None:
+            if frame.is_object:
+                frame.container[frame.key] = value
+            else:
+                frame.container.append(value)
+
+    def _start_string(self, is_key: bool) -> None:
+        self._string = []
+        self._string_is_key = is_key
+        self._streaming = not is_key and self._child_path() == ('result', 'html')
+
+    def _parse_string(self, text: str) -> bool:
+        """Разбор строки до закрывающей кавычки; False - нужны следующие данные"""
+        # Без кавычки в куске строка точно не закончилась
+        if text.find('"', self._pos) != -1:
+            try:
+                chars, end = scanstring(text, self._pos)
+            except json.JSONDecodeError as e:
+                # Строка не закончилась или оборвана escape-последовательность в конце куска
+                if not e.msg.startswith('Unterminated string') and e.pos < len(text) - 12:
+                    raise
+            else:
+                self._add(chars)
+                self._pos = end
+                self._end_string()
+                return True
+        self._append(text, self._complete_prefix(text))
+        return False
+
+    def _complete_prefix(self, text: str) -> int:
+        """Конец части незакрытой строки, в которой нет оборванных escape-последовательностей"""
+        backslash = text.rfind('\\', self._pos)
+        if backslash == -1:
+            return len(text)
+        # Перед серией обратных слешей escape-последовательность закончилась (иначе JSON некорректен)
+        while backslash > self._pos and text[backslash - 1] == '\\':
+            backslash -= 1
+        end = _STRING_BODY.match(text, backslash).end()
+        if end < len(text) and end + 6 <= len(text):
+            raise ValueError(f"Некорректная escape-последовательность в ответе API: {text[end:end + 6]!r}")
+        # Первая половина суррогатной пары декодируется вместе со второй
+        if end - self._pos >= 6 and _HIGH_SURROGATE.match(text, end - 6, end):
+            start = end - 6
+            while start > self._pos and text[start - 1] == '\\':
+                start -= 1
+            if (end - 6 - start) % 2 == 0:
+                end -= 6
+        return end
+
+    def _append(self, text: str, end: int) -> None:
+        """Добавление разобранной части строки"""
+        if end > self._pos:
+            self._add(scanstring(text[self._pos:end] + '"', 0)[0])
+            self._pos = end
+
+    def _add(self, chars: str) -> None:
+        if not self._streaming:
+            self._account(len(chars))
+        self._string.append(chars)
+
+    def _end_string(self) -> None:
+        value, self._string = ''.join(self._string), None
+        if self._streaming:
+            self._streaming = False
+            self._streamed = True
+            if value:
+                self._events.append(('html', value))
+            self._value(None)
+        elif self._string_is_key:
+            frame = self._stack[-1]
+            frame.key = value
+            frame.expect = 'colon'
+        else:
+            self._value(value)
+
+    def _account(self, size: int) -> None:
+        """Учет размера данных ответа, которые остаются в памяти"""
+        self._size += size
+        if self._size > self.buffer_limit:
+            raise ValueError(f"Данные ответа API (кроме HTML) больше {self.buffer_limit} символов")
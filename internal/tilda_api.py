@@ -0,0 +1,176 @@
+import asyncio
+import contextlib
+import logging
+import random
+import time
+from typing import Any, AsyncIterator, Dict, Optional, Tuple
+
+import httpx
+
+from internal.config import TildaConfig
+from internal.metrics import API_CACHE, API_LATENCY, API_RETRIES
+
+logger = logging.getLogger(__name__)
+
+# Методы, ответы которых можно кратковременно кэшировать
+CACHED_METHODS = ('getprojectinfo', 'getpageslist')
+# HTTP-статусы, при которых запрос имеет смысл повторить
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+class TildaApiError(Exception):
+    """Ошибка, возвращенная Tilda API"""
+
+
+class TildaApiUnavailable(Exception):
+    """Tilda API не ответил успешно после всех повторов"""
+
+
+def check_result(method: str, data: dict) -> Any:
+    """Результат ответа API или TildaApiError, если статус ответа не FOUND"""
+    if not isinstance(data, dict) or data.get('status') != 'FOUND':
+        message = data.get('message', data.get('status')) if isinstance(data, dict) else 'пустой ответ'
+        raise TildaApiError(f"{method}: {message}")
+    return data.get('result')
+
+
+class TokenBucket:
+    """Ограничитель частоты запросов (token bucket)"""
+
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        """Ожидание свободного токена"""
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class TildaApiClient:
+    """Клиент Tilda API: общий пул соединений, таймауты, повторы и ограничение частоты"""
+
+    def __init__(self, config: TildaConfig, bucket: Optional[TokenBucket] = None):
+        self.config = config
+        self._client: Optional[httpx.AsyncClient] = None
+        # Ограничитель частоты может быть общим для нескольких проектов
+        self._bucket = bucket or TokenBucket(config.api_rate, config.api_burst)
+        # (метод, параметры) -> (время устаревания, задача запроса)
+        self._cache: Dict[Tuple, Tuple[float, asyncio.Future]] = {}
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        """Общий клиент (создается при первом обращении)"""
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                base_url=self.config.api_url,
+                timeout=httpx.Timeout(self.config.api_timeout)
+            )
+        return self._client
+
+    async def get(self, method: str, **params) -> Any:
+        """Запрос к API; метаданные проекта берутся из кэша, пока он не устарел"""
+        if method not in CACHED_METHODS or self.config.api_cache_ttl <= 0:
+            return await self._request(method, params)
+
+        key = (method, tuple(sorted(params.items())))
+        now = time.monotonic()
+        cached = self._cache.get(key)
+        if cached is not None and cached[0] > now:
+            # Параллельные вызовы ждут один и тот же запрос
+            API_CACHE.labels('hit').inc()
+            return await asyncio.shield(cached[1])
+
+        API_CACHE.labels('miss').inc()
+        future = asyncio.ensure_future(self._request(method, params))
+        self._cache[key] = (now + self.config.api_cache_ttl, future)
+        try:
+            return await asyncio.shield(future)
+        except Exception:
+            self._cache.pop(key, None)
+            raise
+
+    def invalidate(self, project_id: Optional[str] = None) -> None:
+        """Сброс кэша метаданных (всего или для одного проекта)"""
+        if project_id is None:
+            self._cache.clear()
+            return
+        for key in [k for k in self._cache if ('projectid', project_id) in k[1]]:
+            del self._cache[key]
+
+    def _backoff(self, attempt: int) -> float:
+        """Экспоненциальная задержка с полным джиттером"""
+        return random.uniform(0, min(self.config.api_backoff_max, self.config.api_backoff * 2 ** attempt))
+
+    @contextlib.asynccontextmanager
+    async def stream(self, method: str, **params) -> AsyncIterator[httpx.Response]:
+        """Запрос с чтением тела ответа по частям (без кэша).
+
+        Повторы выполняются только до начала чтения тела; статус в теле ответа
+        проверяет вызывающий код (check_result).
+        """
+        response = await self._send(method, params, stream=True)
+        try:
+            yield response
+        finally:
+            await response.aclose()
+
+    async def _request(self, method: str, params: dict) -> Any:
+        """Запрос с разбором ответа"""
+        response = await self._send(method, params)
+        return check_result(method, response.json())
+
+    async def _send(self, method: str, params: dict, stream: bool = False) -> httpx.Response:
+        """Запрос с повторами при сетевых ошибках, 429 и 5xx"""
+        query = {
+            **params,
+            'publickey': self.config.public_key,
+            'secretkey': self.config.secret_key
+        }
+        for attempt in range(self.config.api_retries + 1):
+            if attempt:
+                API_RETRIES.labels(method).inc()
+            await self._bucket.acquire()
+            delay = None
+            try:
+                with API_LATENCY.labels(method).time():
+                    request = self.client.build_request('GET', f'{method}/', params=query)
+                    response = await self.client.send(request, stream=stream)
+                if response.is_error and stream:
+                    await response.aclose()
+                if response.status_code in RETRY_STATUSES and attempt < self.config.api_retries:
+                    retry_after = response.headers.get('Retry-After')
+                    delay = float(retry_after) if retry_after and retry_after.isdigit() else self._backoff(attempt)
+                    logger.warning(f"Tilda API {method}: HTTP {response.status_code}, повтор через {delay:.1f} с")
+                elif response.is_error:
+                    # Текст исключения httpx содержит URL с секретным ключом, поэтому формируем свой
+                    if response.status_code < 500 and response.status_code != 429:
+                        # Неверный ключ, нет доступа или проекта: повтор задания не поможет
+                        raise TildaApiError(f"{method}: HTTP {response.status_code}")
+                    raise TildaApiUnavailable(f"{method}: HTTP {response.status_code}")
+            except httpx.TransportError as e:
+                if attempt == self.config.api_retries:
+                    raise TildaApiUnavailable(f"{method}: {type(e).__name__}") from e
+                delay = self._backoff(attempt)
+                logger.warning(f"Tilda API {method}: {type(e).__name__}, повтор через {delay:.1f} с")
+
+            if delay is not None:
+                await asyncio.sleep(delay)
+                continue
+            return response
+
+    async def close(self) -> None:
+        """Закрытие пула соединений"""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
@@ -1,15 +1,35 @@
+import asyncio
+import contextlib
+import hashlib
 import logging
+import os
+import time
+from datetime import datetime
 from pathlib import Path
-from typing import List
+from typing import Awaitable, Dict, Iterable, Iterator, List, Optional, Set, TypeVar, Union
 
-import requests
+import httpx
 from pydantic import BaseModel, Field
-from requests.exceptions import RequestException
 
+from internal.cleanup import OrphanCollector
+from internal.compressor import SIDECAR_SUFFIXES, Precompressor
 from internal.config import TildaConfig
+from internal.downloader import AssetDownloader, DownloadIntegrityError
+from internal.images import ImageOptimizer
+from internal.job_queue import JobCheckpoint
+from internal.manifest import AssetRecord, ExportManifest, FileRecord
+from internal.metrics import record_export
+from internal.storage import SnapshotStorage, file_digest, files_equal, write_if_changed
+from internal.streaming import ASSET_TYPES, PageExportParser
+from internal.tilda_api import TildaApiClient, TildaApiError, TokenBucket, check_result
 
 logger = logging.getLogger(__name__)
 
+T = TypeVar('T')
+
+class PageAssetsError(Exception):
+    """Часть ассетов страницы не сохранена: страница остается в прежней версии"""
+
 class TildaAsset(BaseModel):
     """Модель для ассетов Tilda"""
     from_url: str = Field(None, alias='from')
@@ -25,6 +45,7 @@ class TildaPage(BaseModel):
     id: str
     title: str
     filename: str
+    published: Optional[str] = None
     
 class TildaPageExport(BaseModel):
     """Модель экспорта страницы"""
@@ -34,104 +55,841 @@ class TildaPageExport(BaseModel):
     js: List[TildaAsset]
     css: List[TildaAsset]
 
+class ExportRun:
+    """Состояние одного запуска экспорта"""
+
+    def __init__(self, full: bool = False, root: Optional[Path] = None):
+        # Полный экспорт проекта или обновление отдельных страниц
+        self.full = full
+        # Каталог версии, в которую пишутся файлы (None - запись на месте)
+        self.root = root
+        # Загрузки ассетов текущего запуска: общий файл скачивается один раз на все страницы
+        self.assets: Dict[Path, asyncio.Task] = {}
+        # Число страниц, ожидающих загрузку (она отменяется вместе с последней из них)
+        self.asset_waiters: Dict[Path, int] = {}
+        # Файлы, содержимое которых изменилось в этом запуске
+        self.changed: Set[Path] = set()
+        # Изображения для фоновой оптимизации и ее задача (возвращает изменившиеся файлы)
+        self.images: Set[Path] = set()
+        self.post_process: Optional[asyncio.Task] = None
+        # Файлы, замененные оптимизацией (в том числе прерванной следующим экспортом)
+        self.optimized: Set[Path] = set()
+        # Страницы, которые не удалось экспортировать: id -> текст ошибки
+        self.failed_pages: Dict[str, str] = {}
+        # Ассеты, которые не удалось сохранить: путь -> текст ошибки (прежняя копия остается)
+        self.failed_assets: Dict[str, str] = {}
+        self.pages_exported = 0
+
+        # Тайминги и счетчики для метрик
+        self.started = time.time()
+        self.phases: Dict[str, float] = {}
+        self.files_downloaded = 0
+        self.bytes_downloaded = 0
+        self.cache_hits = 0
+
+    @property
+    def failures(self) -> Optional[dict]:
+        """Страницы и ассеты, которые не удалось экспортировать (None - экспорт полный)"""
+        if not (self.failed_pages or self.failed_assets):
+            return None
+        return {'pages': dict(self.failed_pages), 'assets': dict(self.failed_assets)}
+
+    @property
+    def status(self) -> str:
+        """Итог экспорта для метрик и журнала заданий"""
+        return 'partial' if self.failures else 'ok'
+
+    @property
+    def unchanged_count(self) -> int:
+        """Число ассетов, которые не пришлось обновлять"""
+        return len(self.assets.keys() - self.changed)
+
+    @contextlib.contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        """Учет времени операции в фазе экспорта (операции фазы суммируются)"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = self.phases.get(name, 0.0) + time.perf_counter() - started
+
+    async def timed(self, name: str, awaitable: Awaitable[T]) -> T:
+        """Ожидание с учетом времени в фазе экспорта"""
+        with self.phase(name):
+            return await awaitable
+
+    def timing_record(self, project_id: str, status: str) -> dict:
+        """Структурированная запись о длительности экспорта"""
+        return {
+            'event': 'export',
+            'project_id': project_id,
+            'kind': 'full' if self.full else 'incremental',
+            'status': status,
+            'started_at': datetime.fromtimestamp(self.started).isoformat(timespec='seconds'),
+            'duration': round(time.time() - self.started, 3),
+            'phases': {name: round(seconds, 3) for name, seconds in self.phases.items()},
+            'pages': self.pages_exported,
+            'failed_pages': sorted(self.failed_pages),
+            'failed_assets': sorted(self.failed_assets),
+            'files_downloaded': self.files_downloaded,
+            'bytes_downloaded': self.bytes_downloaded,
+            'cache_hits': self.cache_hits,
+            'changed_files': len(self.changed)
+        }
+
+
 class TildaExporter:
     """Экспортер статических страниц из Tilda"""
     
-    def __init__(self, config: TildaConfig):
+    def __init__(
+        self, config: TildaConfig, downloader: Optional[AssetDownloader] = None,
+        api_bucket: Optional[TokenBucket] = None
+    ):
         self.config = config
-        
-    def _save_file(self, source_url: str, local_path: Path) -> None:
-        """Сохранение файла"""
+        self.manifest = ExportManifest(config.manifest_path)
+        # Загрузчик и ограничитель частоты API могут быть общими для нескольких проектов
+        self.api = TildaApiClient(config, api_bucket)
+        self.downloader = downloader or AssetDownloader(config)
+        self.storage = SnapshotStorage(config)
+        self.compressor = Precompressor(config)
+        self.optimizer = ImageOptimizer(config)
+        self.collector = OrphanCollector(config, self.storage)
+        self._post_process: Optional[asyncio.Task] = None
+        self._post_run: Optional[ExportRun] = None
+
+    async def close(self) -> None:
+        """Освобождение сетевых ресурсов и пулов процессов"""
+        if self._post_process is not None:
+            self._post_process.cancel()
+            await asyncio.wait([self._post_process])
+        await self.api.close()
+        await self.downloader.close()
+        self.compressor.close()
+        self.optimizer.close()
+
+    async def _save_file(self, source_url: str, local_path: Path, run: ExportRun) -> None:
+        """Сохранение файла (не более одной загрузки на путь за запуск).
+
+        Отмена ожидания не прерывает загрузку, которую ждут другие страницы; отмененная
+        или неудавшаяся загрузка при следующем обращении начинается заново.
+        """
+        while True:
+            task = run.assets.get(local_path)
+            # Отмененная или неудавшаяся загрузка (страница экспортируется повторно) начинается заново
+            if task is None or task.cancelled() or (task.done() and task.exception() is not None):
+                task = run.assets[local_path] = asyncio.ensure_future(self._fetch_file(source_url, local_path, run))
+            run.asset_waiters[local_path] = run.asset_waiters.get(local_path, 0) + 1
+            try:
+                await asyncio.shield(task)
+                return
+            except asyncio.CancelledError:
+                if asyncio.current_task().cancelling():
+                    if run.asset_waiters[local_path] == 1:
+                        task.cancel()
+                    raise
+                # Загрузку отменила другая страница, пока эта ее ждала: скачиваем заново
+            finally:
+                run.asset_waiters[local_path] -= 1
+
+    async def _fetch_file(self, source_url: str, local_path: Path, run: ExportRun) -> None:
+        """Загрузка файла с учетом кэша из манифеста"""
+        target = self.storage.resolve(local_path, run.root)
+        target.parent.mkdir(parents=True, exist_ok=True)
         try:
-            response = requests.get(source_url, stream=True)
-            response.raise_for_status()
-            
-            with open(local_path, 'wb') as f:
-                for chunk in response.iter_content(chunk_size=1024):
-                    if chunk:
-                        f.write(chunk)
-        except RequestException as e:
+            record, changed, received = await run.timed('asset_download', self.downloader.download(
+                source_url, target, self.manifest.get_asset(local_path), self.config.project_id or ''
+            ))
+        except (httpx.HTTPError, DownloadIntegrityError) as e:
             logger.error(f"Ошибка при сохранении {source_url}: {e}")
             raise
 
-    def _process_assets(self, assets: List[dict], asset_type: str) -> None:
-        """Обработка ассетов"""
-        for asset_dict in assets:
+        if received:
+            run.files_downloaded += 1
+            run.bytes_downloaded += received
+        else:
+            run.cache_hits += 1
+        self.manifest.set_asset(local_path, record)
+        if record.stored_size is None:
+            # Файл скачан заново: запись о пережатой оптимизатором копии больше к нему не относится
+            self.manifest.drop_file(local_path)
+        if changed:
+            run.changed.add(local_path)
+        if self.optimizer.accepts(local_path):
+            run.images.add(local_path)
+        await self._compress(local_path, changed, run)
+
+    async def _compress(self, local_path: Path, changed: bool, run: ExportRun) -> None:
+        """Обновление сжатых копий файла (только если он изменился или копий еще нет)"""
+        target = self.storage.resolve(local_path, run.root)
+        if not self.compressor.needs_update(target, changed):
+            return
+        existed = {path for path in self.compressor.sidecars(target) if path.exists()}
+        try:
+            written = await run.timed('compress', self.compressor.compress(target))
+        except Exception as e:
+            logger.error(f"Ошибка сжатия {local_path}: {e}")
+            return
+        run.changed.update(
+            local_path.with_name(path.name) for path in self.compressor.sidecars(target)
+            if path in existed or path.exists()
+        )
+        for fmt, digest in written.items():
+            sidecar = local_path.with_name(local_path.name + SIDECAR_SUFFIXES[fmt])
+            if digest is None:
+                self.manifest.drop_file(sidecar)
+            else:
+                self.manifest.set_file(sidecar, *digest, source=local_path)
+
+    async def _process_asset(self, asset_dict: dict, asset_type: str, run: ExportRun) -> None:
+        """Обработка одного ассета; ошибка записывается в run.failed_assets и передается выше"""
+        name = asset_dict.get('from', 'unknown')
+        try:
+            local_path = self._asset_path(asset_dict, asset_type)
+            name = str(local_path)
+            await self._save_file(asset_dict['from'], local_path, run)
+        except Exception as e:
+            logger.error(f"Ошибка обработки {asset_type} {asset_dict.get('from', 'unknown')}: {e}")
+            # Текст ошибок httpx многострочный: в статус попадает первая строка
+            run.failed_assets[name] = (str(e) or type(e).__name__).splitlines()[0]
+            raise
+        run.failed_assets.pop(name, None)
+
+    @staticmethod
+    async def _await_assets(downloads: Iterable[Awaitable[None]]) -> None:
+        """Ожидание всех загрузок ассетов страницы; PageAssetsError, если часть не сохранена"""
+        results = await asyncio.gather(*downloads, return_exceptions=True)
+        errors = [result for result in results if isinstance(result, BaseException)]
+        if errors:
+            first = (str(errors[0]) or type(errors[0]).__name__).splitlines()[0]
+            raise PageAssetsError(f"не сохранено файлов страницы: {len(errors)} ({first})")
+
+    def _asset_path(self, asset_dict: dict, asset_type: str) -> Path:
+        """Локальный путь ассета"""
+        return self.config.get_path(asset_type) / Path(asset_dict['to']).name
+
+    def _page_assets(self, result: dict) -> List[str]:
+        """Ассеты, на которые ссылается страница (для индекса ссылок)"""
+        return [
+            str(self._asset_path(asset_dict, asset_type))
+            for asset_type in ('images', 'js', 'css')
+            for asset_dict in result.get(asset_type, [])
+            if asset_dict.get('to')
+        ]
+
+    def _collect_orphans(self, run: ExportRun, previous_html: Iterable[Path] = ()) -> None:
+        """Очистка файлов без ссылок после экспорта (удаления попадают в коммит)"""
+        with run.phase('gc'):
             try:
-                source_url = asset_dict['from']
-                local_path = self.config.get_path(asset_type) / Path(asset_dict['to']).name
-                local_path.parent.mkdir(parents=True, exist_ok=True)
-                self._save_file(source_url, local_path)
-            except Exception as e:
-                logger.error(f"Ошибка обработки {asset_type} {asset_dict.get('from', 'unknown')}: {e}")
+                run.changed.update(self.collector.collect(self.manifest, run.root, previous_html))
+                self.optimizer.prune(
+                    {record.optimized for record in self.manifest.assets.values() if record.optimized},
+                    self.config.gc_grace
+                )
+            except OSError as e:
+                logger.error(f"Ошибка очистки файлов без ссылок: {e}")
+
+    async def _process_assets(self, assets: List[dict], asset_type: str, run: ExportRun) -> None:
+        """Обработка ассетов проекта (параллельно, в пределах лимитов загрузчика).
+
+        Ошибки не прерывают экспорт: они попадают в run.failed_assets, а прежние копии остаются.
+        """
+        await asyncio.gather(*(
+            self._process_asset(asset_dict, asset_type, run) for asset_dict in assets
+        ), return_exceptions=True)
 
-    async def extract_project(self, project_id: str) -> None:
-        """Экспорт проекта"""
+    async def extract_project(self, project_id: str, checkpoint: Optional[JobCheckpoint] = None) -> ExportRun:
+        """Экспорт проекта (с чекпоинтами задания продолжает прерванный экспорт)"""
+        deferred = await self._stop_post_process()
         logger.info(f"Начало экспорта проекта {project_id}")
+        # При включенных снапшотах экспорт собирается в отдельной версии и публикуется целиком
+        # Копия дерева жесткими ссылками и удаление старых версий идут в потоке, не блокируя event loop
+        root = await asyncio.to_thread(self.storage.begin_full, checkpoint.root if checkpoint else None)
+        run = ExportRun(full=True, root=root)
+        run.images.update(deferred)
+        if checkpoint is not None:
+            checkpoint.set_root(run.root)
+            if checkpoint.pages:
+                logger.info(
+                    f"Продолжаем прерванный экспорт проекта {project_id}: готово страниц {len(checkpoint.pages)}"
+                )
+            run.changed.update(Path(path) for path in checkpoint.project.get('changed', []))
         
         try:
-            # Получаем информацию о проекте
-            project_info = requests.get(
-                'https://api.tildacdn.info/v1/getprojectinfo/',
-                params={
-                    'projectid': project_id,
-                    'publickey': self.config.public_key,
-                    'secretkey': self.config.secret_key
-                }
+            # Получаем информацию о проекте, ассеты проекта качаем параллельно со списком страниц
+            project_data = await run.timed('api_metadata', self.api.get('getprojectinfo', projectid=project_id))
+            _, pages_list = await asyncio.gather(
+                self._process_assets(project_data['images'], 'images', run),
+                run.timed('api_metadata', self.api.get('getpageslist', projectid=project_id))
             )
-            project_info.raise_for_status()
-            project_data = project_info.json()['result']
-            self._process_assets(project_data['images'], 'images')
-
-            # Получаем список страниц
-            pages_list = requests.get(
-                'https://api.tildacdn.info/v1/getpageslist/',
-                params={
-                    'projectid': project_id,
-                    'publickey': self.config.public_key,
-                    'secretkey': self.config.secret_key
-                }
-            )
-            pages_list.raise_for_status()
+            if checkpoint is not None:
+                checkpoint.save_project({'changed': [str(path) for path in run.changed]})
+
+            # Обрабатываем страницы конвейером: ассеты и HTML страницы сохраняются,
+            # как только пришел ее экспорт, не дожидаясь остальных
+            pages = [TildaPage.model_validate(p) for p in pages_list]
+            api_limit = asyncio.Semaphore(self.config.page_concurrency)
+            entries = await asyncio.gather(*(
+                self._export_or_resume(project_id, page, run, api_limit, checkpoint) for page in pages
+            ))
+
+            previous = self.manifest.pages
+            self.manifest.replace_pages({})
+            for page, entry in zip(pages, entries):
+                if entry is not None:
+                    self.manifest.set_page(page.id, entry['filename'], entry['published'], entry['assets'])
+                elif page.id in previous:
+                    # Сохраняем прежнюю запись, чтобы следующий экспорт повторил страницу
+                    self.manifest.pages[page.id] = previous[page.id]
+            self.manifest.project_assets = self._page_assets({'images': project_data['images']})
+            html_path = self.config.get_path('html')
+            self._collect_orphans(run, [html_path / page['filename'] for page in previous.values()])
+            with run.phase('disk_write'):
+                await asyncio.to_thread(self.storage.publish, run.root, self.manifest.to_dict())
+                self.manifest.save()
 
-            # Обрабатываем страницы
-            for page in [TildaPage.model_validate(p) for p in pages_list.json()['result']]:
-                await self._extract_page(project_id, page)
-                
-            logger.info(f"Проект {project_id} экспортирован")
+            if run.failed_pages:
+                logger.error(
+                    f"Проект {project_id}: не удалось экспортировать страницы "
+                    f"{', '.join(run.failed_pages)}"
+                )
+            logger.info(
+                f"Проект {project_id} экспортирован: страниц {len(pages) - len(run.failed_pages)}, "
+                f"обновлено ассетов {len(run.changed)}, без изменений {run.unchanged_count}"
+            )
+            if run.failed_assets:
+                logger.error(f"Проект {project_id}: не удалось сохранить файлы {', '.join(sorted(run.failed_assets))}")
+            self._report(project_id, run, run.status)
+            self._start_post_process(run)
+            return run
             
         except Exception as e:
             logger.error(f"Ошибка экспорта проекта {project_id}: {e}")
+            self._report(project_id, run, 'error')
+            if run.root is not None:
+                # Версия не опубликована: откатываем и файлы, и записи манифеста о них
+                await asyncio.to_thread(self.storage.abort, run.root)
+                self.manifest.load()
             raise
 
-    async def _extract_page(self, project_id: str, page: TildaPage) -> None:
-        """Экспорт страницы"""
+    def has_previous_export(self) -> bool:
+        """Есть ли опубликованный экспорт с манифестом, от которого можно обновляться"""
+        return bool(self.manifest.pages) and self.storage.has_live()
+
+    async def sync_stale(
+        self, project_id: str, pages: Optional[Dict[str, Optional[str]]] = None,
+        checkpoint: Optional[JobCheckpoint] = None
+    ) -> Optional[ExportRun]:
+        """Сверка времени публикации страниц с манифестом и экспорт только устаревших"""
+        if not self.has_previous_export():
+            logger.info("Предыдущий экспорт не найден, выполняем полный экспорт")
+            return await self.extract_project(project_id, checkpoint)
+
+        remote = [TildaPage.model_validate(p) for p in await self.api.get('getpageslist', projectid=project_id)]
+        deleted = self.manifest.pages.keys() - {page.id for page in remote}
+        if deleted:
+            logger.info(f"Страницы {', '.join(sorted(deleted))} удалены в Tilda, выполняем полный экспорт")
+            return await self.extract_project(project_id, checkpoint)
+
+        stale = dict(pages or {})
+        for page in remote:
+            known = self.manifest.get_page(page.id)
+            if known and known['filename'] != page.filename:
+                logger.info(f"Страница {page.id} переименована, выполняем полный экспорт")
+                return await self.extract_project(project_id, checkpoint)
+            if known is None or known.get('published') != page.published:
+                stale[page.id] = page.published
+
+        if not stale:
+            logger.info(f"Экспорт проекта {project_id} актуален")
+            return None
+        if len(stale) > self.config.incremental_page_limit:
+            logger.info(f"Устарело страниц: {len(stale)}, выполняем полный экспорт")
+            return await self.extract_project(project_id, checkpoint)
+        return await self.update_pages(project_id, stale, checkpoint, remote)
+
+    async def update_pages(
+        self, project_id: str, pages: Dict[str, Optional[str]], checkpoint: Optional[JobCheckpoint] = None,
+        remote: Optional[List[TildaPage]] = None
+    ) -> Optional[ExportRun]:
+        """Инкрементальный экспорт страниц (id -> published) с откатом на полный экспорт.
+
+        remote - уже полученный список страниц проекта (нужен для потокового экспорта).
+        """
+        deferred = await self._stop_post_process()
+        if not self.has_previous_export():
+            logger.info("Предыдущий экспорт не найден, выполняем полный экспорт")
+            return await self.extract_project(project_id, checkpoint)
+
+        stale = {}
+        for page_id, published in pages.items():
+            known = self.manifest.get_page(page_id)
+            if known and published and known.get('published') == published and self.storage.resolve(
+                self.config.get_path('html') / known['filename'], self.storage.live_root()
+            ).exists():
+                logger.info(f"Страница {page_id} уже экспортирована (published={published}), пропускаем")
+                continue
+            stale[page_id] = known
+        if not stale:
+            return None
+
+        # Файлы заменяются в опубликованной версии по одному через rename
+        run = ExportRun(root=self.storage.live_root())
+        run.images.update(deferred)
+        api_limit = asyncio.Semaphore(self.config.page_concurrency)
+
+        async def keep_previous(page_id: str, export: Awaitable[T]) -> Optional[T]:
+            # Страница, ассеты которой не сохранились, остается в прежней версии, остальные обновляются
+            try:
+                return await export
+            except PageAssetsError as e:
+                logger.error(f"Страница {page_id} не обновлена: {e}")
+                run.failed_pages[page_id] = str(e)
+                return None
+
+        if self.config.stream_export:
+            # Потоковый экспорт пишет страницы сразу, поэтому переименование проверяется заранее по списку страниц
+            if remote is None:
+                remote = [TildaPage.model_validate(p) for p in await self.api.get('getpageslist', projectid=project_id)]
+            filenames = {page.id: page.filename for page in remote}
+            for page_id, known in stale.items():
+                if page_id not in filenames:
+                    logger.info(f"Страница {page_id} не найдена в Tilda, выполняем полный экспорт")
+                    return await self.extract_project(project_id, checkpoint)
+                if known and known['filename'] != filenames[page_id]:
+                    logger.info(f"Страница {page_id} переименована, выполняем полный экспорт")
+                    return await self.extract_project(project_id, checkpoint)
+            logger.info(f"Инкрементальный экспорт страниц {', '.join(stale)} проекта {project_id}")
+            tasks = [
+                asyncio.ensure_future(keep_previous(page_id, self._stream_page(project_id, page_id, run, api_limit)))
+                for page_id in stale
+            ]
+        else:
+            tasks = [asyncio.ensure_future(self._fetch_page(project_id, page_id, run, api_limit)) for page_id in stale]
+        try:
+            results = await asyncio.gather(*tasks)
+        except BaseException as e:
+            # Остальные страницы останавливаются: их заново экспортирует полный экспорт или повтор задания
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            if not isinstance(e, TildaApiError):
+                raise
+            logger.info(f"Страница недоступна ({e}), выполняем полный экспорт")
+            return await self.extract_project(project_id, checkpoint)
+
+        for (page_id, known), result in zip(stale.items(), results):
+            if result is not None and known and known['filename'] != result['filename']:
+                logger.info(f"Страница {page_id} переименована, выполняем полный экспорт")
+                return await self.extract_project(project_id, checkpoint)
+
+        if not self.config.stream_export:
+            logger.info(f"Инкрементальный экспорт страниц {', '.join(stale)} проекта {project_id}")
         try:
-            page_info = requests.get(
-                'https://api.tildacdn.info/v1/getpagefullexport/',
-                params={
-                    'projectid': project_id,
-                    'pageid': page.id,
-                    'publickey': self.config.public_key,
-                    'secretkey': self.config.secret_key
-                }
+            project_data = await run.timed('api_metadata', self.api.get('getprojectinfo', projectid=project_id))
+            await asyncio.gather(
+                self._process_assets(project_data['images'], 'images', run),
+                *(
+                    keep_previous(page_id, self._save_page(result, run))
+                    for page_id, result in zip(stale, results) if not self.config.stream_export
+                )
             )
-            page_info.raise_for_status()
-            
-            result = page_info.json()['result']
-            
-            # Обрабатываем ассеты
-            self._process_assets(result['images'], 'images')
-            self._process_assets(result['js'], 'js')
-            self._process_assets(result['css'], 'css')
 
-            # Сохраняем HTML
-            html_path = self.config.get_path('html') / result['filename']
-            html_path.parent.mkdir(parents=True, exist_ok=True)
-            html_path.write_text(result['html'], encoding='utf-8')
-            
-            logger.info(f"Страница {page.id} экспортирована")
+            for page_id, result in zip(stale, results):
+                if result is not None and page_id not in run.failed_pages:
+                    self.manifest.set_page(
+                        page_id, result['filename'], result.get('published'), self._page_assets(result)
+                    )
+                    run.pages_exported += 1
+            self.manifest.project_assets = self._page_assets({'images': project_data['images']})
+            self._collect_orphans(run)
+            with run.phase('disk_write'):
+                self.manifest.save()
+                self.storage.save_release_manifest(run.root, self.manifest.to_dict())
+        except Exception:
+            self._report(project_id, run, 'error')
+            raise
+
+        if run.failures:
+            logger.error(
+                f"Проект {project_id}: не обновлены страницы {', '.join(sorted(run.failed_pages)) or '-'}, "
+                f"не сохранены файлы {', '.join(sorted(run.failed_assets)) or '-'}"
+            )
+        self._report(project_id, run, run.status)
+        self._start_post_process(run)
+        return run
+
+    async def _wait_post_process(self) -> None:
+        """Ожидание фоновой обработки предыдущего экспорта (она меняет файлы и манифест)"""
+        if self._post_process is not None and not self._post_process.done():
+            logger.info("Ожидание оптимизации изображений предыдущего экспорта")
+            await asyncio.wait([self._post_process])
+
+    async def _stop_post_process(self) -> Set[Path]:
+        """Остановка фоновой обработки перед новым экспортом, чтобы не задерживать его публикацию.
+
+        Возвращает изображения прерванной оптимизации: их обработает следующий проход
+        (уже установленные копии повторно не обрабатываются).
+        """
+        if self._post_process is None or self._post_process.done():
+            return set()
+        logger.info("Оптимизация изображений предыдущего экспорта прервана, продолжится после нового экспорта")
+        self._post_process.cancel()
+        await asyncio.wait([self._post_process])
+        # Записи об уже установленных копиях сохраняются, даже если новый экспорт не удастся
+        self.manifest.save()
+        self.storage.save_release_manifest(self._post_run.root, self.manifest.to_dict())
+        return self._post_run.images
+
+    def _start_post_process(self, run: ExportRun) -> None:
+        """Запуск оптимизации изображений в фоне, когда HTML уже опубликован"""
+        if run.images:
+            run.post_process = self._post_process = asyncio.ensure_future(self._optimize_images(run))
+            self._post_run = run
+
+    async def _optimize_images(self, run: ExportRun) -> Set[Path]:
+        """Оптимизация изображений экспорта; возвращает изменившиеся файлы"""
+        started = time.perf_counter()
+        results = await asyncio.gather(*(self._optimize_image(path, run) for path in sorted(run.images)))
+        changed = set().union(*results)
+        self.manifest.save()
+        self.storage.save_release_manifest(run.root, self.manifest.to_dict())
+        logger.info(
+            f"Оптимизация изображений завершена за {time.perf_counter() - started:.1f} с: "
+            f"изображений {len(run.images)}, обновлено файлов {len(changed)}"
+        )
+        return changed
+
+    async def _optimize_image(self, local_path: Path, run: ExportRun) -> Set[Path]:
+        """Установка оптимизированных копий изображения (из кэша или после обработки)"""
+        record = self.manifest.get_asset(local_path)
+        target = self.storage.resolve(local_path, run.root)
+        if record is None or self.optimizer.is_installed(target, record):
+            return set()
+        try:
+            installed = await self.optimizer.optimize(target, record.sha256)
+        except Exception as e:
+            logger.error(f"Ошибка оптимизации {local_path}: {e}")
+            return set()
+
+        # Контрольные суммы установленных копий (для проверки экспорта)
+        digests = await asyncio.to_thread(
+            lambda: {name: file_digest(target.with_name(name)) for name in installed}
+        )
+        for name in set(record.variants) | {target.name}:
+            if name not in installed:
+                self.manifest.drop_file(local_path.with_name(name))
+        for name, digest in digests.items():
+            self.manifest.set_file(local_path.with_name(name), *digest, source=local_path)
+
+        stored_size = target.stat().st_size
+        self.manifest.set_asset(local_path, record.model_copy(update={
+            'optimized': self.optimizer.cache_key(record.sha256),
+            'variants': sorted(name for name in installed if name != target.name),
+            'stored_size': stored_size if stored_size != record.size else None
+        }))
+        changed = {local_path.with_name(name) for name, replaced in installed.items() if replaced}
+        run.optimized.update(changed)
+        return changed
+
+    def _report(self, project_id: str, run: ExportRun, status: str) -> None:
+        """Метрики и JSON-запись о завершенном экспорте"""
+        record_export(run.timing_record(project_id, status), self.config.timing_log_path)
+
+    async def _export_or_resume(
+        self, project_id: str, page: TildaPage, run: ExportRun, api_limit: asyncio.Semaphore,
+        checkpoint: Optional[JobCheckpoint]
+    ) -> Optional[dict]:
+        """Страница полного экспорта; возвращает запись для манифеста (filename, published, assets).
+
+        Страница из чекпоинта прерванного экспорта, которую с тех пор не переопубликовали,
+        повторно не экспортируется: ее файлы уже лежат в каталоге версии.
+        """
+        html_path = self.config.get_path('html')
+        saved = checkpoint.pages.get(page.id) if checkpoint is not None else None
+        if saved is not None and page.published and saved['published'] == page.published \
+                and self.storage.resolve(html_path / saved['filename'], run.root).exists():
+            for path, record in saved['records'].items():
+                self.manifest.set_asset(Path(path), AssetRecord.model_validate(record))
+                if self.optimizer.accepts(Path(path)):
+                    run.images.add(Path(path))
+            for path, record in saved.get('files', {}).items():
+                self.manifest.files[path] = FileRecord.model_validate(record)
+            run.changed.update(Path(path) for path in saved['changed'])
+            return saved
+
+        result = await self._export_page(project_id, page.id, run, api_limit)
+        if result is None:
+            return None
+        entry = {
+            'filename': result['filename'],
+            'published': result.get('published'),
+            'assets': self._page_assets(result)
+        }
+        if checkpoint is not None:
+            # Файлы страницы и их сжатые копии, изменившиеся в этом запуске, нужны для коммита
+            own = [html_path / result['filename']] + [Path(path) for path in entry['assets']]
+            own += [path.with_name(path.name + suffix) for path in own for suffix in SIDECAR_SUFFIXES.values()]
+            own_paths = {str(path) for path in own}
+            checkpoint.save_page(page.id, {
+                **entry,
+                'records': {
+                    path: self.manifest.assets[path].model_dump()
+                    for path in entry['assets'] if path in self.manifest.assets
+                },
+                'files': {
+                    path: record.model_dump() for path, record in self.manifest.files.items()
+                    if path in own_paths or record.source in own_paths
+                },
+                'changed': [str(path) for path in own if path in run.changed]
+            })
+        return entry
+
+    async def _export_page(
+        self, project_id: str, page_id: str, run: ExportRun, api_limit: asyncio.Semaphore
+    ) -> Optional[dict]:
+        """Экспорт страницы с повторами; ошибка не прерывает экспорт остальных страниц"""
+        for attempt in range(self.config.page_retries + 1):
+            try:
+                return await self._extract_page(project_id, page_id, run, api_limit)
+            except Exception as e:
+                if attempt == self.config.page_retries:
+                    run.failed_pages[page_id] = str(e)
+                    return None
+                logger.warning(f"Повторный экспорт страницы {page_id}, попытка {attempt + 2}")
+                await asyncio.sleep(self.config.page_retry_delay * (attempt + 1))
+
+    async def _extract_page(
+        self, project_id: str, page_id: str, run: ExportRun, api_limit: Optional[asyncio.Semaphore] = None
+    ) -> dict:
+        """Экспорт страницы"""
+        try:
+            if self.config.stream_export:
+                result = await self._stream_page(project_id, page_id, run, api_limit)
+            else:
+                result = await self._fetch_page(project_id, page_id, run, api_limit)
+                await self._save_page(result, run)
+            run.pages_exported += 1
+            logger.info(f"Страница {page_id} экспортирована")
+            return result
             
         except Exception as e:
-            logger.error(f"Ошибка экспорта страницы {page.id}: {e}")
-            raise
\ No newline at end of file
+            logger.error(f"Ошибка экспорта страницы {page_id}: {e}")
+            raise
+
+    async def _fetch_page(
+        self, project_id: str, page_id: str, run: ExportRun, api_limit: Optional[asyncio.Semaphore] = None
+    ) -> dict:
+        """Получение полного экспорта страницы"""
+        async with api_limit or contextlib.nullcontext():
+            return await run.timed(
+                'page_export', self.api.get('getpagefullexport', projectid=project_id, pageid=page_id)
+            )
+
+    async def _stream_page(
+        self, project_id: str, page_id: str, run: ExportRun, api_limit: Optional[asyncio.Semaphore] = None
+    ) -> dict:
+        """Экспорт страницы с разбором ответа по мере получения.
+
+        HTML пишется во временный файл, а загрузка ассетов начинается, как только
+        они встречаются в ответе. Возвращает поля результата без HTML.
+        """
+        html_dir = self.storage.resolve(self.config.get_path('html'), run.root)
+        html_dir.mkdir(parents=True, exist_ok=True)
+        tmp = html_dir / f'.page-{page_id}.tmp'
+        parser = PageExportParser(self.config.stream_buffer_limit)
+        result: dict = {asset_type: [] for asset_type in ASSET_TYPES}
+        downloads: List[asyncio.Future] = []
+        digest = hashlib.sha256()
+
+        def handle(events: List[tuple]) -> None:
+            for event in events:
+                if event[0] == 'html':
+                    data = event[1].encode('utf-8')
+                    file.write(data)
+                    digest.update(data)
+                elif event[0] == 'asset':
+                    result[event[1]].append(event[2])
+                    downloads.append(asyncio.ensure_future(self._process_asset(event[2], event[1], run)))
+                else:
+                    result[event[1]] = event[2]
+
+        try:
+            # Временный файл открывается только в слоте API, чтобы ожидающие страницы не держали дескрипторы
+            async with api_limit or contextlib.nullcontext():
+                with open(tmp, 'wb') as file, run.phase('page_export'):
+                    async with self.api.stream(
+                        'getpagefullexport', projectid=project_id, pageid=page_id
+                    ) as response:
+                        async for chunk in response.aiter_bytes(self.config.download_chunk_size):
+                            handle(parser.feed(chunk))
+                    handle(parser.close())
+            check_result('getpagefullexport', parser.root)
+            if not result.get('filename'):
+                raise TildaApiError(f"getpagefullexport: в ответе для страницы {page_id} нет filename")
+
+            # HTML переносится на место после ассетов, чтобы страница не ссылалась на еще не скачанные файлы
+            await self._await_assets(downloads)
+            html_path = self.config.get_path('html') / result['filename']
+            target = self.storage.resolve(html_path, run.root)
+            with run.phase('disk_write'):
+                size = tmp.stat().st_size
+                try:
+                    changed = not files_equal(tmp, target)
+                except FileNotFoundError:
+                    changed = True
+                if changed:
+                    os.replace(tmp, target)
+        except BaseException:
+            # Загрузки ассетов неудавшейся страницы останавливаются (общие с другими страницами продолжаются)
+            for download in downloads:
+                download.cancel()
+            await asyncio.gather(*downloads, return_exceptions=True)
+            raise
+        finally:
+            tmp.unlink(missing_ok=True)
+
+        self.manifest.set_file(html_path, size, digest.hexdigest())
+        if changed:
+            run.changed.add(html_path)
+        await self._compress(html_path, changed, run)
+        return result
+
+    async def _save_page(self, result: dict, run: ExportRun) -> None:
+        """Сохранение ассетов и HTML страницы"""
+        # Обрабатываем ассеты; если часть не сохранилась, HTML не обновляется
+        await self._await_assets(
+            self._process_asset(asset_dict, asset_type, run)
+            for asset_type in ASSET_TYPES for asset_dict in result[asset_type]
+        )
+
+        # Сохраняем HTML после ассетов, чтобы страница не ссылалась на еще не скачанные файлы
+        html_path = self.config.get_path('html') / result['filename']
+        data = result['html'].encode('utf-8')
+        with run.phase('disk_write'):
+            changed = write_if_changed(self.storage.resolve(html_path, run.root), data)
+        self.manifest.set_file(html_path, len(data), hashlib.sha256(data).hexdigest())
+        if changed:
+            run.changed.add(html_path)
+        await self._compress(html_path, changed, run)
+
+    async def verify(self, project_id: str, repair: bool = True) -> dict:
+        """Проверка опубликованного экспорта по манифесту: размер и SHA-256 ассетов, HTML страниц,
+        сжатых копий и копий оптимизатора (параллельно). При repair ассеты скачиваются заново,
+        сжатые копии и копии оптимизатора создаются заново, а страницы экспортируются повторно."""
+        await self._wait_post_process()
+        root = self.storage.live_root()
+        limit = asyncio.Semaphore(self.config.verify_workers)
+
+        async def check(path: str, record: Union[AssetRecord, FileRecord]) -> Optional[str]:
+            async with limit:
+                try:
+                    size, sha256 = await asyncio.to_thread(file_digest, self.storage.resolve(Path(path), root))
+                except FileNotFoundError:
+                    return 'missing'
+            if isinstance(record, AssetRecord) and record.stored_size is not None:
+                # Манифест без контрольной суммы пережатой копии: проверяется только размер
+                return None if size == record.stored_size else 'size'
+            if size != record.size:
+                return 'size'
+            return None if sha256 == record.sha256 else 'sha256'
+
+        def expected() -> Dict[str, Union[AssetRecord, FileRecord]]:
+            # Ассет, замененный копией оптимизатора, проверяется по записи о ней
+            return {
+                **{path: record for path, record in self.manifest.assets.items() if path not in self.manifest.files},
+                **self.manifest.files
+            }
+
+        records = expected()
+        problems = await asyncio.gather(*(check(path, record) for path, record in records.items()))
+        corrupt = {path: problem for path, problem in zip(records, problems) if problem}
+        html_path = self.config.get_path('html')
+        pages = {str(html_path / page['filename']): page_id for page_id, page in self.manifest.pages.items()}
+        # HTML без записи в манифесте (экспорт предыдущей версии) проверяется только на наличие
+        missing_pages = sorted(
+            page_id for path, page_id in pages.items()
+            if path not in self.manifest.files and not self.storage.resolve(Path(path), root).exists()
+        )
+        report = {
+            'project_id': project_id,
+            'files': len(records),
+            'pages': len(self.manifest.pages),
+            'corrupt': corrupt,
+            'missing_pages': missing_pages,
+            'repaired': [],
+            'failed': []
+        }
+        logger.info(
+            f"Проверка проекта {project_id}: файлов {len(records)}, поврежденных {len(corrupt)}, "
+            f"отсутствующих страниц {len(missing_pages)}"
+        )
+        if not repair or not (corrupt or missing_pages):
+            return report
+
+        files = [path for path in corrupt if path not in pages]
+        if files:
+            run = ExportRun(root=root)
+            refetch, recompress, reoptimize = set(), set(), set()
+            for path in files:
+                source = self.manifest.files[path].source if path in self.manifest.files else path
+                if source == path:
+                    refetch.add(path)
+                elif any(path == source + suffix for suffix in SIDECAR_SUFFIXES.values()):
+                    recompress.add(source)
+                else:
+                    reoptimize.add(source)
+
+            # Копии оптимизатора - жесткие ссылки на кэш: поврежденный результат удаляется из кэша
+            for path in (refetch | reoptimize) & self.manifest.assets.keys():
+                if self.manifest.assets[path].optimized:
+                    self.optimizer.forget(self.manifest.assets[path].sha256)
+            assets = {path: self.manifest.assets.pop(path) for path in refetch}
+            # Без записи в манифесте файл скачивается целиком, без условного запроса
+            results = await asyncio.gather(*(
+                self._fetch_file(record.url, Path(path), run) for path, record in assets.items()
+            ), return_exceptions=True)
+            for (path, record), result in zip(assets.items(), results):
+                if isinstance(result, Exception):
+                    self.manifest.assets[path] = record
+            for path in sorted(recompress - refetch):
+                await self._compress(Path(path), True, run)
+            for path in sorted(reoptimize - refetch):
+                if path in self.manifest.assets:
+                    self.manifest.set_asset(Path(path), self.manifest.assets[path].model_copy(update={'optimized': None}))
+                    run.images.add(Path(path))
+            with run.phase('disk_write'):
+                self.manifest.save()
+                self.storage.save_release_manifest(run.root, self.manifest.to_dict())
+            self._start_post_process(run)
+            await self._wait_post_process()
+
+            # Результат восстановления проверяется заново (файл, который больше не создается, не проверяется)
+            records = expected()
+            problems = await asyncio.gather(*(
+                check(path, records[path]) if path in records else asyncio.sleep(0) for path in files
+            ))
+            for path, problem in zip(files, problems):
+                report['failed' if problem else 'repaired'].append(path)
+
+        broken_pages = sorted(set(missing_pages) | {pages[path] for path in corrupt if path in pages})
+        if broken_pages:
+            try:
+                await self.update_pages(project_id, {page_id: None for page_id in broken_pages})
+                report['repaired'] += [f'page:{page_id}' for page_id in broken_pages]
+            except Exception as e:
+                logger.error(f"Не удалось восстановить страницы {', '.join(broken_pages)}: {e}")
+                report['failed'] += [f'page:{page_id}' for page_id in broken_pages]
+            await self._wait_post_process()
+        return report
+
+    async def rollback(self, version: Optional[str] = None) -> str:
+        """Откат на предыдущую (или указанную) опубликованную версию.
+
+        Оптимизация изображений последнего экспорта останавливается: иначе она записала бы
+        в манифест восстановленной версии записи о файлах более новой.
+        """
+        await self._stop_post_process()
+        version, manifest_data = self.storage.rollback(version)
+        self.manifest.from_dict(manifest_data)
+        self.manifest.save()
+        return version
@@ -1,16 +1,29 @@
+import argparse
 import asyncio
+import functools
+import json
 import logging
+import sys
 from datetime import datetime
-from typing import Optional
+from typing import Dict, Optional
 
 import uvicorn
-from fastapi import FastAPI, Query, HTTPException, Request, BackgroundTasks
-from fastapi.responses import PlainTextResponse
+from fastapi import FastAPI, Query, HTTPException, Request, Header, Depends
+from fastapi.responses import JSONResponse, PlainTextResponse, Response
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
+from pydantic import BaseModel
 from contextlib import asynccontextmanager
 
-from internal.committer import Committer
+from internal.committer import GitPublisher
 from internal.config import TildaConfig
-from internal.tilda_exporter import TildaExporter
+from internal.downloader import AssetDownloader
+from internal.job_queue import JobQueue
+from internal.leader import ExportLease
+from internal.metrics import QUEUE_DEPTH, STATIC_CACHE_BYTES
+from internal.scheduler import ExportJob, ExportScheduler
+from internal.static_site import StaticSite
+from internal.tilda_api import TokenBucket
+from internal.tilda_exporter import ExportRun, TildaExporter
 
 # Настройка логирования
 logging.basicConfig(
@@ -19,43 +32,74 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+class ProjectState(BaseModel):
+    """Готовность проекта"""
+    # warm - есть предыдущий экспорт, cold - экспорт с нуля, blocking - экспорт до старта,
+    # follower - проект экспортирует другой процесс
+    mode: Optional[str] = None
+    # Этот процесс экспортирует проект (держит его блокировку)
+    leader: bool = False
+    # Экспорт на диске можно отдавать
+    ready: bool = False
+    # Экспорт сверен с опубликованными в Tilda страницами после запуска
+    synced: bool = False
+    error: Optional[str] = None
+
+class ServiceState(BaseModel):
+    """Готовность сервиса для эндпоинтов проверки состояния"""
+    projects: Dict[str, ProjectState] = {}
+
+    @property
+    def ready(self) -> bool:
+        return all(project.ready for project in self.projects.values())
+
+    @property
+    def synced(self) -> bool:
+        return all(project.synced for project in self.projects.values())
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Действия при запуске и завершении работы сервера"""
     # Код выполняемый при запуске
     logger.info(f"Запуск сервера на {config.host}:{config.port}")
-    logger.info(f"Конфигурация загружена для проекта {config.project_id}")
-    try:
-        logger.info("Выполняем начальный экспорт проекта")
+    for project_id, exporter in exporters.items():
+        logger.info(f"Конфигурация загружена для проекта {project_id}")
         logger.info("Пути сохранения файлов:")
-        logger.info(f"  HTML: {config.get_path('html')}")
-        logger.info(f"  Images: {config.get_path('images')}")
-        logger.info(f"  CSS: {config.get_path('css')}")
-        logger.info(f"  JS: {config.get_path('js')}")
-        await exporter.extract_project(config.project_id)
-        logger.info("Начальный экспорт завершен успешно")
-        
-        # Создаем коммит при старте
-        try:
-            if config.push_to_git:
-                logger.info("Git push отключен")
-                # logger.info("Создаем коммит при старте сервера")
-                # committer = Committer(config)
-                # committer.commit_changes("Автоматический коммит при старте сервера")
-                # logger.info("Коммит при старте создан успешно")
-        except Exception as e:
-            logger.error(f"Ошибка при создании коммита: {str(e)}")
-            # Продолжаем работу даже если коммит не удался
-            pass
-            
-    except Exception as e:
-        logger.error(f"Ошибка при начальном экспорте: {e}", exc_info=True)
-        raise
+        logger.info(f"  HTML: {exporter.config.get_path('html')}")
+        logger.info(f"  Images: {exporter.config.get_path('images')}")
+        logger.info(f"  CSS: {exporter.config.get_path('css')}")
+        logger.info(f"  JS: {exporter.config.get_path('js')}")
+    # Проект экспортирует только процесс, захвативший его блокировку. Остальные процессы
+    # (воркеры uvicorn, реплики на общем томе) раздают файлы и передают вебхуки через журнал
+    for project_id, lease in leases.items():
+        if lease.try_acquire():
+            # Задания, не завершенные до перезапуска, выполняются первыми (с продолжением с чекпоинтов)
+            scheduler.restore(project_id)
+        else:
+            logger.info(f"Проект {project_id} экспортирует другой процесс ({lease.owner()})")
+    if config.startup_mode == 'blocking':
+        await initial_export()
+        scheduler.start()
+    else:
+        scheduler.start()
+        warm_start()
+    coordinator = asyncio.create_task(coordinate())
     
     yield  # Здесь приложение работает
     
     # Код выполняемый при завершении работы
     logger.info("Завершение работы сервера")
+    coordinator.cancel()
+    await asyncio.wait([coordinator])
+    await scheduler.stop()
+    for publisher in publishers.values():
+        await publisher.close()
+    for exporter in exporters.values():
+        await exporter.close()
+    await downloader.close()
+    queue.close()
+    for lease in leases.values():
+        lease.release()
 
 # Инициализация
 app = FastAPI(
@@ -69,53 +113,202 @@ config = TildaConfig()
 if not config.is_valid:
     raise RuntimeError("Отсутствуют необходимые переменные окружения")
 
-exporter = TildaExporter(config)
+# Загрузчик ассетов и ограничитель частоты Tilda API общие: проекты делят один бюджет запросов
+downloader = AssetDownloader(config)
+api_bucket = TokenBucket(config.api_rate, config.api_burst)
+exporters: Dict[str, TildaExporter] = {
+    project_id: TildaExporter(config.for_project(project_id), downloader, api_bucket)
+    for project_id in config.project_ids
+}
+state = ServiceState(projects={project_id: ProjectState() for project_id in exporters})
+leases = {
+    project_id: ExportLease(exporter.config.state_path / 'export.lock')
+    for project_id, exporter in exporters.items()
+}
+# Время изменения манифестов проектов, которые экспортируют другие процессы
+manifest_mtimes: Dict[str, Optional[int]] = {}
+
+publishers: Dict[str, GitPublisher] = {}
+for project_id, exporter in exporters.items():
+    if not exporter.config.push_to_git:
+        continue
+    if exporter.config.snapshots:
+        logger.warning(f"Публикация в Git не поддерживается при TILDA_SNAPSHOTS=true (проект {project_id}), отключаем")
+    else:
+        publishers[project_id] = GitPublisher(exporter.config)
+
+# Встроенная раздача экспорта (TILDA_SERVE=true), вместо отдельного веб-сервера.
+# Раздается первый проект из списка (или каталог TILDA_SERVE_ROOT)
+site = StaticSite(config, exporters[config.project_id].storage) if config.serve else None
 
-async def process_webhook_data(projectid: str, pageid: Optional[str], published: Optional[str]):
-    """Фоновая обработка данных вебхука"""
+async def initial_export():
+    """Полный экспорт до начала приема запросов (TILDA_STARTUP_MODE=blocking)"""
+    leading = {project_id: exporter for project_id, exporter in exporters.items() if leases[project_id].held}
     try:
-        logger.info(f"Начало фоновой обработки webhook для проекта {projectid}")
-        logger.info(f"Параметры: pageid={pageid}, published={published}")
-        logger.info(f"Пути сохранения файлов:")
-        logger.info(f"  HTML: {config.get_path('html')}")
-        logger.info(f"  Images: {config.get_path('images')}")
-        logger.info(f"  CSS: {config.get_path('css')}")
-        logger.info(f"  JS: {config.get_path('js')}")
+        logger.info("Выполняем начальный экспорт проектов")
+        runs = await asyncio.gather(*(
+            exporter.extract_project(project_id) for project_id, exporter in leading.items()
+        ))
+        logger.info("Начальный экспорт завершен успешно")
         
-        await exporter.extract_project(projectid)
+        # Публикуем изменения в Git (коммит создается в фоне, ошибки не мешают работе)
+        for project_id, run in zip(leading, runs):
+            publish_changes(project_id, run)
+    except Exception as e:
+        logger.error(f"Ошибка при начальном экспорте: {e}", exc_info=True)
+        raise
+    for project_id in exporters:
+        if project_id in leading:
+            project = state.projects[project_id]
+            project.mode, project.leader = 'blocking', True
+            project.ready = project.synced = True
+        else:
+            watch_project(project_id)
+
+def warm_start():
+    """Запуск без ожидания экспорта: сверка с Tilda выполняется в очереди экспорта"""
+    for project_id, lease in leases.items():
+        if lease.held:
+            start_project(project_id)
+        else:
+            watch_project(project_id)
+
+def start_project(project_id: str):
+    """Начало работы с проектом в ведущем процессе: сверка с Tilda или полный экспорт в фоне"""
+    exporter = exporters[project_id]
+    project = state.projects[project_id]
+    project.leader = True
+    if exporter.has_previous_export():
+        project.mode = 'warm'
+        project.ready = True
+        logger.info(f"Проект {project_id}: найден предыдущий экспорт, проверяем актуальность страниц в фоне")
+        scheduler.submit(project_id, sync=True)
+    else:
+        project.mode = 'cold'
+        logger.info(f"Проект {project_id}: предыдущий экспорт не найден, выполняем полный экспорт в фоне")
+        scheduler.submit(project_id)
+
+def watch_project(project_id: str):
+    """Состояние проекта, который экспортирует другой процесс: манифест и кэш раздачи
+    обновляются после его экспортов"""
+    exporter = exporters[project_id]
+    try:
+        mtime = exporter.manifest.path.stat().st_mtime_ns
+    except FileNotFoundError:
+        mtime = None
+    if mtime != manifest_mtimes.get(project_id):
+        manifest_mtimes[project_id] = mtime
+        exporter.manifest.load()
+        if site is not None:
+            site.invalidate()
+    project = state.projects[project_id]
+    project.mode = 'follower'
+    project.ready = project.synced = exporter.has_previous_export()
+
+async def coordinate():
+    """Координация процессов: захват проектов, освободившихся после остановки ведущего,
+    прием переданных заданий и слежение за проектами других процессов"""
+    while True:
+        await asyncio.sleep(config.leader_poll)
+        for project_id, lease in leases.items():
+            try:
+                if lease.held:
+                    if scheduler.restore(project_id):
+                        # Переданные вебхуки: список страниц в кэше API мог устареть
+                        exporters[project_id].api.invalidate(project_id)
+                elif lease.try_acquire():
+                    logger.info(f"Процесс стал ведущим для проекта {project_id}")
+                    exporters[project_id].manifest.load()
+                    scheduler.restore(project_id)
+                    start_project(project_id)
+                else:
+                    watch_project(project_id)
+            except Exception as e:
+                logger.error(f"Ошибка координации проекта {project_id}: {e}")
+
+def startup_job_finished(job: ExportJob, error: Optional[Exception] = None):
+    """Учет результата первой сверки/экспорта проекта после запуска"""
+    project = state.projects[job.project_id]
+    if project.synced or not (job.full or job.sync):
+        return
+    if error is None:
+        project.ready = project.synced = True
+        project.error = None
+        return
+    project.error = str(error)
+    logger.warning(
+        f"Начальная синхронизация проекта {job.project_id} не удалась, повтор через {config.startup_retry_delay} с"
+    )
+    asyncio.get_running_loop().call_later(
+        config.startup_retry_delay,
+        lambda: scheduler.submit(job.project_id, sync=not job.full)
+    )
+
+def publish_changes(project_id: str, run: Optional[ExportRun]):
+    """Публикация результата экспорта: сброс кэша раздачи и коммит изменившихся файлов"""
+    if site is not None:
+        site.invalidate()
+    if run is not None and run.post_process is not None:
+        # Оптимизированные изображения публикуются, когда будут готовы
+        run.post_process.add_done_callback(functools.partial(publish_post_processed, project_id, run))
+    publisher = publishers.get(project_id)
+    if publisher is None:
+        logger.info("Git push пропущен (PUSH_TO_GIT=false)")
+    elif run is not None and run.changed:
+        publisher.add(run.changed)
+
+def publish_post_processed(project_id: str, run: ExportRun, task: asyncio.Task):
+    """Публикация файлов фоновой обработки экспорта (и прерванной новым экспортом)"""
+    if site is not None:
+        site.invalidate()
+    if not task.cancelled() and task.exception() is not None:
+        logger.error(f"Ошибка фоновой обработки экспорта проекта {project_id}: {task.exception()}")
+    publisher = publishers.get(project_id)
+    if publisher is not None and run.optimized:
+        publisher.add(run.optimized)
+
+async def process_webhook_data(job: ExportJob) -> Optional[dict]:
+    """Фоновая обработка задания, собранного из вебхуков; возвращает неудавшиеся страницы и файлы"""
+    exporter = exporters[job.project_id]
+    try:
+        logger.info(f"Начало фоновой обработки webhook для проекта {job.project_id}")
+        logger.info(f"Параметры: pages={job.pages}, full={job.full}, sync={job.sync}")
+        logger.info(f"Пути сохранения файлов:")
+        logger.info(f"  HTML: {exporter.config.get_path('html')}")
+        logger.info(f"  Images: {exporter.config.get_path('images')}")
+        logger.info(f"  CSS: {exporter.config.get_path('css')}")
+        logger.info(f"  JS: {exporter.config.get_path('js')}")
         
-        # Создаем коммит только если включен push_to_git
-        if config.push_to_git:
-            logger.info("Git push отключен")
-            # current_date = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            # commit_message = f"Автоматическое обновление от Tilda {current_date}"
-            # committer = Committer(config)
-            # committer.commit_changes(commit_message)
-            # logger.info("Git push выполнен успешно")
+        # Чекпоинты страниц позволяют продолжить полный экспорт, прерванный перезапуском
+        checkpoint = queue.checkpoint(job) if job.id is not None else None
+        if job.full:
+            run = await exporter.extract_project(job.project_id, checkpoint)
+        elif job.sync:
+            run = await exporter.sync_stale(job.project_id, job.pages, checkpoint)
         else:
-            logger.info("Git push пропущен (PUSH_TO_GIT=false)")
+            run = await exporter.update_pages(job.project_id, job.pages, checkpoint)
+        
+        # Коммитим только изменившиеся файлы, если включен push_to_git
+        publish_changes(job.project_id, run)
+        startup_job_finished(job)
         
         logger.info(f"Фоновая обработка webhook завершена успешно")
+        return run.failures if run is not None else None
     except Exception as e:
         logger.error(f"Ошибка при фоновой обработке webhook: {e}", exc_info=True)
+        if site is not None:
+            # Без снапшотов часть файлов могла обновиться до ошибки
+            site.invalidate()
+        startup_job_finished(job, e)
+        raise
 
-async def export_project():
-    try:
-        logger.info(f"Начало экспорта файлов")
-        if config.push_to_git:
-            logger.info("Git push отключен")
-            # committer = Committer(config)
-            # committer.commit_changes()
-            # logger.info("Git push выполнен успешно")
-        else:
-            logger.info("Git push пропущен (PUSH_TO_GIT=false)")
-        logger.info(f"Экспорт завершен успешно")
-    except Exception as e:
-        logger.error(f"Ошибка при экспорте файлов: {e}", exc_info=True)
+queue = JobQueue(config)
+scheduler = ExportScheduler(config, process_webhook_data, queue)
+QUEUE_DEPTH.set_function(lambda: scheduler.queue_depth)
+STATIC_CACHE_BYTES.set_function(lambda: site.cache_bytes if site is not None else 0)
 
 @app.get("/webhook", response_class=PlainTextResponse)
 async def handle_webhook(
-    background_tasks: BackgroundTasks,
     request: Request,
     projectid: str = Query(..., description="ID проекта Tilda"),
     publickey: str = Query(..., description="Публичный ключ для верификации"),
@@ -127,15 +320,129 @@ async def handle_webhook(
     logger.info(f"Получен webhook запрос от {client_host}")
     logger.info(f"Параметры запроса: {dict(request.query_params)}")
     
-    if publickey != config.public_key:
+    exporter = exporters.get(projectid)
+    if exporter is None:
+        logger.warning(f"Webhook для неизвестного проекта {projectid} от {client_host}")
+        raise HTTPException(status_code=404, detail="Неизвестный проект")
+    if publickey != exporter.config.public_key:
         logger.warning(f"Попытка доступа с неверным ключом от {client_host}")
         raise HTTPException(status_code=403, detail="Неверный публичный ключ")
     
-    # Добавляем задачу в фоновую обработку и сразу возвращаем ответ
-    background_tasks.add_task(process_webhook_data, projectid, pageid, published)
-    logger.info(f"Webhook запрос принят в обработку")
+    # Страницы проекта изменились: сверка не должна читать getpageslist из кэша
+    exporter.api.invalidate(projectid)
+    # Добавляем задачу в очередь экспорта и сразу возвращаем ответ
+    if leases[projectid].held:
+        scheduler.submit(projectid, pageid, published)
+        logger.info(f"Webhook запрос принят в обработку, заданий в очереди: {scheduler.queue_depth}")
+    else:
+        scheduler.forward(projectid, pageid, published)
+        logger.info("Проект экспортирует другой процесс, webhook передан через журнал заданий")
     return "ok"
 
+@app.get("/status")
+async def export_status():
+    """Состояние очереди экспорта"""
+    return scheduler.status()
+
+@app.get("/health/live")
+async def liveness():
+    """Проверка, что процесс отвечает"""
+    return {'status': 'alive'}
+
+@app.get("/health/ready")
+async def readiness():
+    """Готовность отдавать экспорт (503, пока нет ни одного успешного экспорта)"""
+    return JSONResponse(
+        {'ready': state.ready, 'synced': state.synced, **state.model_dump()},
+        status_code=200 if state.ready else 503
+    )
+
+@app.get("/metrics")
+async def metrics():
+    """Метрики в формате Prometheus"""
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+def require_admin(x_admin_token: Optional[str] = Header(None)):
+    """Проверка токена служебных эндпоинтов"""
+    if not config.admin_token:
+        raise HTTPException(status_code=404, detail="Служебные эндпоинты отключены")
+    if x_admin_token != config.admin_token:
+        raise HTTPException(status_code=403, detail="Неверный токен")
+
+@app.get("/admin/queue", dependencies=[Depends(require_admin)])
+async def queue_jobs(
+    status: Optional[str] = Query(None, description="Статус: pending, running, done, failed, merged"),
+    limit: int = Query(50, ge=1, le=1000, description="Число заданий")
+):
+    """Журнал заданий экспорта (новые первыми)"""
+    return {'jobs': queue.list(status, limit)}
+
+@app.post("/admin/rollback", dependencies=[Depends(require_admin)])
+async def rollback(
+    version: Optional[str] = Query(None, description="Версия (по умолчанию предыдущая)"),
+    project: Optional[str] = Query(None, description="ID проекта (по умолчанию первый)")
+):
+    """Откат опубликованного экспорта на предыдущую версию"""
+    project = project or config.project_id
+    exporter = exporters.get(project)
+    if exporter is None:
+        raise HTTPException(status_code=404, detail="Неизвестный проект")
+    if not leases[project].held:
+        raise HTTPException(status_code=409, detail=f"Проект экспортирует другой процесс ({leases[project].owner()})")
+    if project in scheduler.running:
+        raise HTTPException(status_code=409, detail="Выполняется экспорт, повторите позже")
+    try:
+        version = await exporter.rollback(version)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if site is not None:
+        site.invalidate()
+    logger.info(f"Откат на версию {version} выполнен")
+    return {'version': version, 'releases': exporter.storage.releases()}
+
+async def serve_static(request: Request, path: str):
+    """Раздача файлов экспорта"""
+    return await site.serve(request, path)
+
+# Регистрируется последним, чтобы не перекрывать служебные эндпоинты
+if site is not None:
+    app.add_api_route("/{path:path}", serve_static, methods=["GET", "HEAD"], include_in_schema=False)
+
+async def verify_projects(project: Optional[str], repair: bool) -> int:
+    """Проверка целостности экспорта проектов; код возврата 1, если остались поврежденные файлы"""
+    code = 0
+    try:
+        for project_id in [project] if project else list(exporters):
+            lease = leases[project_id]
+            # Файлы нельзя восстанавливать, пока проект экспортирует работающий сервер
+            if not lease.try_acquire():
+                logger.error(f"Проект {project_id} экспортирует другой процесс ({lease.owner()}), проверка пропущена")
+                code = 1
+                continue
+            report = await exporters[project_id].verify(project_id, repair)
+            print(json.dumps(report, ensure_ascii=False, indent=2))
+            if report['failed'] or not repair and (report['corrupt'] or report['missing_pages']):
+                code = 1
+    finally:
+        for exporter in exporters.values():
+            await exporter.close()
+        await downloader.close()
+        for lease in leases.values():
+            lease.release()
+    return code
+
+def run_verify(argv: list) -> int:
+    """Команда python main.py verify"""
+    parser = argparse.ArgumentParser(
+        prog='main.py verify', description="Проверка файлов экспорта по манифесту и восстановление поврежденных"
+    )
+    parser.add_argument('--project', choices=list(exporters), help="ID проекта (по умолчанию все)")
+    parser.add_argument('--no-repair', action='store_true', help="только проверить, ничего не скачивая")
+    args = parser.parse_args(argv)
+    return asyncio.run(verify_projects(args.project, not args.no_repair))
+
 if __name__ == '__main__':
+    if sys.argv[1:2] == ['verify']:
+        sys.exit(run_verify(sys.argv[2:]))
     uvicorn.run(app, host=config.host, port=config.port)
     # TODO REMOVE /DOCS!!!
@@ -0,0 +1,156 @@
+"""Проверка PageExportParser: документы, разрезанные на случайные куски, против json.loads"""
+import json
+import random
+import unittest
+
+from internal.streaming import ASSET_TYPES, PageExportParser
+
+# Символы, на которых ломаются разбор escape-последовательностей и UTF-8 на границе куска
+ALPHABET = ['a', 'Z', '0', ' ', '"', '\\', '/', '\n', '\t', '\b', '\f', '\r', '\x00', '\x1f', 'é', 'Ж', '€', '😀', ' ']
+
+
+def random_string(rng: random.Random, max_length: int = 20) -> str:
+    return ''.join(rng.choice(ALPHABET) for _ in range(rng.randint(0, max_length)))
+
+
+def random_value(rng: random.Random, depth: int = 0):
+    kinds = ['string', 'int', 'float', 'bool', 'null'] + (['list', 'dict'] if depth < 4 else [])
+    kind = rng.choice(kinds)
+    if kind == 'string':
+        return random_string(rng)
+    if kind == 'int':
+        return rng.randint(-10 ** 12, 10 ** 12)
+    if kind == 'float':
+        return rng.uniform(-1e6, 1e6)
+    if kind == 'bool':
+        return rng.random() < 0.5
+    if kind == 'null':
+        return None
+    if kind == 'list':
+        return [random_value(rng, depth + 1) for _ in range(rng.randint(0, 4))]
+    return {random_string(rng, 8): random_value(rng, depth + 1) for _ in range(rng.randint(0, 4))}
+
+
+def random_document(rng: random.Random) -> dict:
+    """Ответ getpagefullexport со случайными полями в случайном порядке"""
+    result = {
+        'html': ''.join(random_string(rng, 200) for _ in range(rng.randint(0, 50))),
+        'filename': random_string(rng) + '.html',
+        'extra': random_value(rng),
+        'nested': [[random_value(rng) for _ in range(3)] for _ in range(rng.randint(0, 3))],
+    }
+    for asset_type in ASSET_TYPES:
+        result[asset_type] = [
+            {'from': random_string(rng), 'to': random_string(rng), 'meta': random_value(rng)}
+            for _ in range(rng.randint(0, 5))
+        ]
+    items = list(result.items())
+    rng.shuffle(items)
+    return {'status': 'FOUND', 'result': dict(items), 'message': random_string(rng)}
+
+
+def parse(raw: bytes, rng: random.Random, buffer_limit: int = 1 << 20, max_chunk: int = 64) -> tuple:
+    """Разбор ответа кусками случайного размера; возвращает HTML, ассеты, поля и корень"""
+    parser = PageExportParser(buffer_limit)
+    html, assets, fields = [], {asset_type: [] for asset_type in ASSET_TYPES}, {}
+
+    def handle(events):
+        for event in events:
+            if event[0] == 'html':
+                html.append(event[1])
+            elif event[0] == 'asset':
+                assets[event[1]].append(event[2])
+            else:
+                fields[event[1]] = event[2]
+
+    position = 0
+    while position < len(raw):
+        size = rng.randint(1, max_chunk)
+        handle(parser.feed(raw[position:position + size]))
+        position += size
+    handle(parser.close())
+    return ''.join(html), assets, fields, parser.root
+
+
+class PageExportParserTest(unittest.TestCase):
+
+    def assert_matches(self, raw: bytes, rng: random.Random, **kwargs) -> None:
+        expected = json.loads(raw)
+        html, assets, fields, root = parse(raw, rng, **kwargs)
+        result = expected.pop('result')
+        self.assertEqual(html, result.pop('html'))
+        self.assertEqual(assets, {asset_type: result.pop(asset_type) for asset_type in ASSET_TYPES})
+        self.assertEqual(fields, result)
+        self.assertEqual(root, {**expected, 'result': None})
+
+    def test_random_documents(self):
+        rng = random.Random(20)
+        for _ in range(300):
+            document = random_document(rng)
+            for ensure_ascii in (True, False):
+                raw = json.dumps(document, ensure_ascii=ensure_ascii).encode('utf-8')
+                self.assert_matches(raw, rng)
+
+    def test_byte_by_byte(self):
+        rng = random.Random(1)
+        for _ in range(30):
+            raw = json.dumps(random_document(rng), ensure_ascii=rng.random() < 0.5).encode('utf-8')
+            self.assert_matches(raw, rng, max_chunk=1)
+
+    def test_whitespace_and_escapes(self):
+        rng = random.Random(2)
+        raw = (
+            b' \n{ "status" :\t"FOUND" ,\r\n "result" : { "html" : "\\u0041\\ud83d\\ude00\\\\\\"\\/\\n" ,'
+            b' "images" : [ { "from" : "a" , "to" : "b" } , 1 , [ ] ] , "js" : [ ] , "css" : [ ] ,'
+            b' "n" : -0.5e-3 , "t" : true , "f" : false , "z" : null } } \n'
+        )
+        for _ in range(200):
+            html, assets, fields, root = parse(raw, rng, max_chunk=5)
+            self.assertEqual(html, 'A\U0001F600\\"/\n')
+            # Элементы списков ассетов, которые не объекты, пропускаются
+            self.assertEqual(assets['images'], [{'from': 'a', 'to': 'b'}])
+            self.assertEqual(fields, {'n': -0.5e-3, 't': True, 'f': False, 'z': None})
+            self.assertEqual(root, {'status': 'FOUND', 'result': None})
+
+    def test_error_response(self):
+        html, assets, fields, root = parse(b'{"status": "ERROR", "message": "Page not found"}', random.Random(3))
+        self.assertEqual(root, {'status': 'ERROR', 'message': 'Page not found'})
+        self.assertEqual((html, fields), ('', {}))
+
+    def test_html_is_not_buffered(self):
+        # HTML больше лимита проходит: он отдается кусками и в памяти не накапливается
+        raw = json.dumps({'status': 'FOUND', 'result': {'html': 'x' * 100000, 'filename': 'a.html'}}).encode()
+        html, _, fields, _ = parse(raw, random.Random(4), buffer_limit=100, max_chunk=4096)
+        self.assertEqual((len(html), fields), (100000, {'filename': 'a.html'}))
+
+    def test_total_buffer_limit(self):
+        # Каждое поле и ассет меньше лимита, но вместе они больше
+        fields = {f'field{i}': 'x' * 50 for i in range(10)}
+        assets = [{'from': 'y' * 40, 'to': 'z'} for _ in range(10)]
+        for result in (fields, {'images': assets}):
+            raw = json.dumps({'status': 'FOUND', 'result': result}).encode()
+            with self.assertRaisesRegex(ValueError, 'больше 200'):
+                parse(raw, random.Random(5), buffer_limit=200)
+
+    def test_unterminated_value_limit(self):
+        parser = PageExportParser(100)
+        parser.feed(b'{"status": "FOUND", "result": {"n": 1')
+        with self.assertRaisesRegex(ValueError, 'Незавершенное значение'):
+            for _ in range(20):
+                parser.feed(b'1' * 10)
+
+    def test_invalid_documents(self):
+        for raw in (
+            b'{"status": "FOU',
+            b'{"status": "FOUND"} {}',
+            b'{"status": "FOUND", "result": {"html": "\\x41"}}',
+            b'{"status": "FOUND", "result": {"n": 12a}}',
+            b'{"status": "FOUND", "result": {"n": "x"}]}',
+            b'{"status": "FOUND", "result": {"html": "abc',
+        ):
+            with self.subTest(raw=raw), self.assertRaises(ValueError):
+                parse(raw, random.Random(6), max_chunk=3)
+
+
+if __name__ == '__main__':
+    unittest.main()